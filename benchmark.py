@@ -0,0 +1,412 @@
+"""
+Offline benchmark suite for the agents and graphs.
+
+Every agent runs against a scripted FunctionModel that plays back fixed tool
+calls and outputs, so what is measured is the framework and our own code:
+time per run and per model step, tool time, tool dispatch cost, output schema
+validation cost and peak memory. No provider is called, placeholder API keys
+are set so the provider clients can be constructed.
+
+Results are saved per commit so runs can be compared:
+
+    python benchmark.py                        # writes benchmark_results/<commit>.json
+    python benchmark.py --compare benchmark_results/abc1234.json
+    python benchmark.py weather never_42 -n 50
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+import tracemalloc
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+for key in ('GEMINI_API_KEY', 'GOOGLE_API_KEY', 'OPENAI_API_KEY', 'GROQ_API_KEY'):
+    os.environ.setdefault(key, 'benchmark')
+# Parse in-process, worker start-up would land in the first run's timing
+os.environ.setdefault('HTML_PARSE_WORKERS', '0')
+
+from pydantic import TypeAdapter
+from pydantic_ai import Agent
+from pydantic_ai.messages import ModelMessage, ModelResponse, TextPart, ToolCallPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from instrumentation import metrics, percentile
+from message_history import split_rounds
+
+RESULTS_DIR = Path('benchmark_results')
+SOUP_PATH = Path(__file__).with_name('soup.txt')
+
+
+# ---------------------------------------------------------------------------
+# Stand-in models
+
+def _step(messages: list[ModelMessage]) -> int:
+    """Model requests already answered in the current run."""
+    return sum(isinstance(m, ModelResponse) for m in split_rounds(messages)[-1])
+
+
+def _output_tool(info: AgentInfo, suffix: str = '') -> str:
+    return next(t.name for t in info.output_tools if t.name.endswith(suffix))
+
+
+def scripted_model(steps: list[list[tuple]]) -> FunctionModel:
+    """
+    Plays back one entry of `steps` per model request of a run, repeating the
+    last one. Entries are lists of ('tool', name, args), ('output', args[, tool
+    name suffix]) or ('text', content).
+    """
+    def respond(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        parts = []
+        for kind, *rest in steps[min(_step(messages), len(steps) - 1)]:
+            if kind == 'tool':
+                parts.append(ToolCallPart(rest[0], rest[1]))
+            elif kind == 'output':
+                parts.append(ToolCallPart(_output_tool(info, *rest[1:]), rest[0]))
+            else:
+                parts.append(TextPart(rest[0]))
+        return ModelResponse(parts=parts)
+
+    return FunctionModel(respond)
+
+
+# ---------------------------------------------------------------------------
+# Fake Sheets service
+
+class _Call:
+    def __init__(self, fn: Callable[[], dict]):
+        self._fn = fn
+
+    def execute(self) -> dict:
+        return self._fn()
+
+
+class FakeSheetsService:
+    """Just enough of the Sheets v4 resource for the agent's tools."""
+
+    def __init__(self):
+        self.sheets = {0: 'Sheet1'}
+        self._next_id = 1
+
+    def spreadsheets(self) -> 'FakeSheetsService':
+        return self
+
+    def get(self, spreadsheetId: str, fields: str | None = None) -> _Call:
+        return _Call(lambda: {'sheets': [{'properties': {'sheetId': i, 'title': t}} for i, t in self.sheets.items()]})
+
+    def batchUpdate(self, spreadsheetId: str, body: dict) -> _Call:
+        def apply() -> dict:
+            replies = []
+            for request in body['requests']:
+                if 'addSheet' in request:
+                    sheet_id, self._next_id = self._next_id, self._next_id + 1
+                    title = request['addSheet']['properties']['title']
+                    self.sheets[sheet_id] = title
+                    replies.append({'addSheet': {'properties': {'sheetId': sheet_id, 'title': title}}})
+                elif 'deleteSheet' in request:
+                    self.sheets.pop(request['deleteSheet']['sheetId'], None)
+                    replies.append({})
+                else:
+                    replies.append({})
+            return {'spreadsheetId': spreadsheetId, 'replies': replies}
+        return _Call(apply)
+
+
+# ---------------------------------------------------------------------------
+# Scenarios, each returns the number of steps it took (model requests or graph nodes)
+
+Scenario = Callable[[], Awaitable[int]]
+
+async def bench_weather() -> int:
+    from weather_agents import Deps, geocode_cache, weather_agent, weather_cache
+
+    # Measure the tools doing their work, not a warm cache
+    geocode_cache.clear()
+    weather_cache.clear()
+    model = scripted_model([
+        [('tool', 'get_lat_lang_many', {'location_descriptions': ['London', 'San Francisco, CA']})],
+        [('tool', 'get_weather_many', {'locations': [
+            {'lat': 10.795323, 'lng': -55.393958},
+            {'lat': 37.7749, 'lng': -122.4194},
+        ]})],
+        [('text', 'Snowing in London, windy in San Francisco.')],
+    ])
+    with weather_agent.override(model=model):
+        result = await weather_agent.run('Weather in London and San Francisco?', deps=Deps(weather_api_key=None, geo_api_key=None))
+    return result.usage().requests
+
+
+async def bench_sheets() -> int:
+    from sheets_agent import SheetsDependencies, sheets_agent
+    from sheets_quota import SheetsQuota
+
+    unlimited = SheetsQuota(reads_per_minute=1e9, writes_per_minute=1e9, burst=1e9)
+    deps = SheetsDependencies(FakeSheetsService(), 'benchmark', quota=unlimited)
+    model = scripted_model([
+        [('tool', 'list_sheets', {})],
+        [('tool', 'add_sheet', {'sheet_name': 'A'}), ('tool', 'add_sheet', {'sheet_name': 'B'})],
+        [('tool', 'delete_sheet', {'sheet_name': 'A'})],
+        [('output', {'request_status': True, 'result_details': 'done'})],
+    ])
+    try:
+        with sheets_agent.override(model=model):
+            result = await sheets_agent.run('Add A and B, then delete A', deps=deps)
+    finally:
+        deps.close()
+    return result.usage().requests
+
+
+def _products(count: int) -> list[dict[str, Any]]:
+    return [
+        {'bramd_name': 'ASUS', 'product_name': f'ROG Strix {i}', 'price': f'{21000 + i:,}', 'rating_count': i}
+        for i in range(count)
+    ]
+
+
+async def bench_web_scraping() -> int:
+    import web_scrapping_agent
+
+    from fetch_cache import CachedResponse
+
+    soup = SOUP_PATH.read_bytes()
+    model = scripted_model([
+        [('tool', 'fetch_html_text', {'url': 'https://www.noon.com/uae-en/search/?q=laptop'})],
+        [('output', {'dataset': _products(20)})],
+    ])
+    fetch_page = web_scrapping_agent.fetch_page
+    web_scrapping_agent.fetch_page = lambda url: CachedResponse(url, 200, {}, soup, from_cache=True)
+    try:
+        with web_scrapping_agent.web_scraping_agent.override(model=model):
+            result = await web_scrapping_agent.web_scraping_agent.run('https://www.noon.com/uae-en/search/?q=laptop')
+    finally:
+        web_scrapping_agent.fetch_page = fetch_page
+    return result.usage().requests
+
+
+EMAIL = {'subject': 'Welcome!', 'body': 'Thanks for subscribing, expect posts on AI agents and photography.'}
+
+def _feedback_model() -> FunctionModel:
+    calls = [0]
+
+    def respond(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        # Ask for one rewrite, then accept
+        calls[0] += 1
+        if calls[0] % 2:
+            return ModelResponse(parts=[ToolCallPart(_output_tool(info, 'EmailRequiresWrite'), {'feedback': 'Mention photography.'})])
+        return ModelResponse(parts=[ToolCallPart(_output_tool(info, 'EmailOk'), {})])
+
+    return FunctionModel(respond)
+
+
+async def bench_email_agents() -> int:
+    from email_feedback import email_writer_agent, feedback_agent
+
+    with email_writer_agent.override(model=scripted_model([[('output', EMAIL)]])), \
+            feedback_agent.override(model=_feedback_model()):
+        written = await email_writer_agent.run('Write a welcome email for Jay')
+        reviewed = await feedback_agent.run(f'Review: {written.output}')
+    return written.usage().requests + reviewed.usage().requests
+
+
+async def _count_graph_steps(graph, start_node, **kwargs) -> int:
+    steps = 0
+    async with graph.iter(start_node, **kwargs) as run:
+        async for _ in run:
+            steps += 1
+    return steps
+
+
+async def bench_graph_example1() -> int:
+    from graph_example1 import NodeA, graph
+    return await _count_graph_steps(graph, NodeA(track_number=4))
+
+
+async def bench_never_42() -> int:
+    from graph_example2 import Increment, MyState, never_42_graph
+    # 41 -> 42 loops back through Increment once before ending
+    return await _count_graph_steps(never_42_graph, Increment(), state=MyState(41))
+
+
+async def bench_feedback_graph() -> int:
+    from email_feedback import FeedbackDeps, State, User, WriteEmail, email_writer_agent, feedback_agent, feedback_graph
+
+    user = User(name='Jay', email='jay@example.com', interests=['AI Agent', 'Photography'])
+    with email_writer_agent.override(model=scripted_model([[('output', EMAIL)]])), \
+            feedback_agent.override(model=_feedback_model()):
+        return await _count_graph_steps(feedback_graph, WriteEmail(), state=State(user), deps=FeedbackDeps())
+
+
+TOOL_CALLS = 20
+_dispatch_agent = Agent()
+
+@_dispatch_agent.tool_plain
+def noop() -> str:
+    return 'ok'
+
+async def _dispatch_run(calls: int) -> int:
+    steps = [[('tool', 'noop', {})] * calls, [('text', 'done')]] if calls else [[('text', 'done')]]
+    result = await _dispatch_agent.run('go', model=scripted_model(steps))
+    return result.usage().requests
+
+async def bench_tool_dispatch() -> int:
+    return await _dispatch_run(TOOL_CALLS)
+
+async def bench_no_tools() -> int:
+    return await _dispatch_run(0)
+
+
+SCENARIOS: dict[str, Scenario] = {
+    'weather': bench_weather,
+    'sheets': bench_sheets,
+    'web_scraping': bench_web_scraping,
+    'email_agents': bench_email_agents,
+    'graph_example1': bench_graph_example1,
+    'never_42': bench_never_42,
+    'feedback_graph': bench_feedback_graph,
+    'tool_dispatch': bench_tool_dispatch,
+    'no_tools': bench_no_tools,
+}
+
+
+# ---------------------------------------------------------------------------
+# Output schema validation
+
+def _validation_cases() -> dict[str, Callable[[], Any]]:
+    from email_feedback import Email
+    from sheets_agent import SheetsResult
+    from web_scrapping_agent import Results
+
+    products_json = json.dumps({'dataset': _products(100)})
+    email_adapter = TypeAdapter(Email)
+    return {
+        'results_100_products': lambda: Results.model_validate_json(products_json),
+        'email': lambda: email_adapter.validate_python(EMAIL),
+        'sheets_result': lambda: SheetsResult.model_validate({'request_status': True, 'result_details': 'done'}),
+    }
+
+
+def bench_validation(iterations: int = 1000) -> dict[str, float]:
+    """Microseconds per validation of each agent output type."""
+    results = {}
+    for name, case in _validation_cases().items():
+        case()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            case()
+        results[name] = (time.perf_counter() - start) / iterations * 1e6
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Runner
+
+@dataclass
+class ScenarioResult:
+    runs: int
+    steps: int
+    median_ms: float
+    p95_ms: float
+    ms_per_step: float
+    tool_ms: float
+    peak_kb: float
+
+
+def run_scenario(scenario: Scenario, runs: int) -> ScenarioResult:
+    with redirect_stdout(open(os.devnull, 'w')):
+        steps = asyncio.run(scenario())  # warm up imports and caches
+
+        timings, tool_seconds = [], metrics.total('agent_tool_seconds')
+        for _ in range(runs):
+            start = time.perf_counter()
+            asyncio.run(scenario())
+            timings.append(time.perf_counter() - start)
+        tool_seconds = metrics.total('agent_tool_seconds') - tool_seconds
+
+        tracemalloc.start()
+        asyncio.run(scenario())
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    median = statistics.median(timings)
+    return ScenarioResult(
+        runs=runs,
+        steps=steps,
+        median_ms=median * 1000,
+        p95_ms=percentile(timings, 0.95) * 1000,
+        ms_per_step=median * 1000 / max(steps, 1),
+        tool_ms=tool_seconds * 1000 / runs,
+        peak_kb=peak / 1024,
+    )
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(current: dict, baseline: dict) -> None:
+    print(f"\nvs {baseline['commit']} (median ms, ratio > 1 is slower)")
+    for name, result in current['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before:
+            ratio = result['median_ms'] / before['median_ms']
+            print(f"  {name:16} {before['median_ms']:9.2f} -> {result['median_ms']:9.2f}  x{ratio:.2f}")
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the agents and graphs against stand-in models.')
+    parser.add_argument('scenarios', nargs='*', help=f"any of {', '.join(SCENARIOS)}, all by default")
+    parser.add_argument('-n', '--runs', type=int, default=20)
+    parser.add_argument('--output', help='results file, defaults to benchmark_results/<commit>.json')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    report = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'scenarios': {},
+        'validation_us': bench_validation(),
+    }
+    for name in args.scenarios or SCENARIOS:
+        result = run_scenario(SCENARIOS[name], args.runs)
+        report['scenarios'][name] = result.__dict__
+        print(
+            f'{name:16} {result.median_ms:9.2f} ms  p95 {result.p95_ms:9.2f} ms  '
+            f'{result.steps:3} steps  {result.ms_per_step:7.2f} ms/step  '
+            f'tools {result.tool_ms:7.2f} ms  peak {result.peak_kb:9.1f} KB'
+        )
+
+    scenarios = report['scenarios']
+    if 'tool_dispatch' in scenarios and 'no_tools' in scenarios:
+        extra = scenarios['tool_dispatch']['median_ms'] - scenarios['no_tools']['median_ms']
+        report['tool_dispatch_ms_per_call'] = extra / TOOL_CALLS
+        print(f"tool dispatch    {report['tool_dispatch_ms_per_call']:9.3f} ms per call")
+    for name, us in report['validation_us'].items():
+        print(f'validate {name:22} {us:9.1f} us')
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{report['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding='utf-8')
+    print(f'Saved {output}')
+
+    if args.compare:
+        compare(report, json.loads(Path(args.compare).read_text(encoding='utf-8')))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
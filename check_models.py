@@ -1,58 +1,190 @@
 import os
 import sys
+import json
+import time
 import asyncio
-from typing import Optional, Tuple
+import argparse
+import statistics
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Optional
 
 from dotenv import load_dotenv
 
 from pydantic_ai import Agent
-from pydantic_ai.models.groq import GroqModel
-from pydantic_ai.models.openai import OpenAIChatModel
-from pydantic_ai.models.google import GoogleModel
+from pydantic_ai.models import Model
 
+from instrumentation import percentile
 
-async def try_run(agent: Agent, label: str) -> Tuple[str, bool, Optional[str]]:
+PROMPT = "Say 'ok' only."
+
+
+@dataclass
+class Provider:
+    label: str
+    env_keys: tuple[str, ...]
+    factory: Callable[[], Model]
+
+    def missing_key(self) -> Optional[str]:
+        if not self.env_keys or any(os.getenv(key) for key in self.env_keys):
+            return None
+        return "/".join(self.env_keys) + " not set"
+
+
+@dataclass
+class Sample:
+    ok: bool
+    latency: Optional[float] = None
+    ttft: Optional[float] = None
+    output_tokens: int = 0
+    error: Optional[str] = None
+
+
+@dataclass
+class ProviderReport:
+    name: str
+    ok: bool
+    error: Optional[str] = None
+    runs: int = 0
+    failures: int = 0
+    latency: dict[str, float] = field(default_factory=dict)
+    ttft: dict[str, float] = field(default_factory=dict)
+    tokens_per_sec: Optional[float] = None
+
+
+def _groq() -> Model:
+    from pydantic_ai.models.groq import GroqModel
+    return GroqModel("llama-3.1-8b-instant")
+
+
+def _openai() -> Model:
+    from pydantic_ai.models.openai import OpenAIChatModel
+    return OpenAIChatModel("gpt-5-nano")
+
+
+def _google() -> Model:
+    from pydantic_ai.models.google import GoogleModel
+    return GoogleModel("gemini-2.5-flash")
+
+
+def _local(base_url: str, model_name: str) -> Callable[[], Model]:
+    def factory() -> Model:
+        from pydantic_ai.models.openai import OpenAIChatModel
+        from pydantic_ai.providers.openai import OpenAIProvider
+        provider = OpenAIProvider(base_url=base_url, api_key=os.getenv("OPENAI_API_KEY", "local"))
+        return OpenAIChatModel(model_name, provider=provider)
+    return factory
+
+
+def providers(base_url: Optional[str] = None, model_name: str = "gpt-5-nano") -> list[Provider]:
+    if base_url:
+        # Any OpenAI-compatible endpoint that streams, e.g. standin_server.py for offline checks
+        return [Provider(f"Local {model_name} @ {base_url}", (), _local(base_url, model_name))]
+    return [
+        Provider("Groq llama-3.1-8b-instant", ("GROQ_API_KEY",), _groq),
+        Provider("OpenAI gpt-5-nano", ("OPENAI_API_KEY",), _openai),
+        Provider("Google Gemini 2.5-flash", ("GOOGLE_API_KEY", "GEMINI_API_KEY"), _google),
+    ]
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    """Nearest-rank p50/p95/p99 (plus min/max) of `values`, in seconds."""
+    if not values:
+        return {}
+    return {
+        "min": round(min(values), 4),
+        "p50": round(percentile(values, 0.50), 4),
+        "p95": round(percentile(values, 0.95), 4),
+        "p99": round(percentile(values, 0.99), 4),
+        "max": round(max(values), 4),
+        "mean": round(statistics.fmean(values), 4),
+    }
+
+
+async def probe(agent: Agent, timeout: float) -> Sample:
+    """Streams one short completion, timing the first token and the full response."""
+    start = time.perf_counter()
+    ttft = None
     try:
-        _ = await agent.run("Say 'ok' only.")
-        return label, True, None
+        async with asyncio.timeout(timeout):
+            async with agent.run_stream(PROMPT) as result:
+                async for _ in result.stream_text(delta=True):
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                latency = time.perf_counter() - start
+                usage = result.usage()
+    except TimeoutError:
+        return Sample(False, error=f"timed out after {timeout}s")
     except Exception as exc:  # noqa: BLE001 - surface provider errors to user
-        return label, False, str(exc)
+        return Sample(False, error=str(exc))
+    return Sample(True, latency, ttft if ttft is not None else latency, usage.output_tokens or 0)
+
 
+async def check_provider(provider: Provider, repeat: int, timeout: float) -> ProviderReport:
+    missing = provider.missing_key()
+    if missing:
+        return ProviderReport(provider.label, False, missing)
+    try:
+        agent = Agent(provider.factory())
+    except Exception as exc:  # noqa: BLE001
+        return ProviderReport(provider.label, False, str(exc))
+
+    # Repeats run back to back so a provider's samples don't compete with each other
+    samples = [await probe(agent, timeout) for _ in range(repeat)]
+    good = [s for s in samples if s.ok]
+    errors = [s.error for s in samples if not s.ok]
+    report = ProviderReport(
+        provider.label,
+        ok=not errors,
+        error=errors[-1] if errors else None,
+        runs=len(samples),
+        failures=len(errors),
+        latency=percentiles([s.latency for s in good]),
+        ttft=percentiles([s.ttft for s in good]),
+    )
+    total_time = sum(s.latency for s in good)
+    if good and total_time > 0:
+        report.tokens_per_sec = round(sum(s.output_tokens for s in good) / total_time, 2)
+    return report
+
+
+async def amain(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check (and optionally benchmark) the configured model providers.")
+    parser.add_argument("--repeat", type=int, default=1, help="probes per provider; >1 reports latency percentiles")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-probe timeout in seconds")
+    parser.add_argument("--json", dest="json_path", nargs="?", const="-", help="write a JSON report to PATH (or stdout)")
+    parser.add_argument("--base-url", help="probe a single OpenAI-compatible endpoint instead of the real providers")
+    parser.add_argument("--model", default="gpt-5-nano", help="model name to request from --base-url")
+    args = parser.parse_args(argv)
 
-async def amain() -> int:
     load_dotenv()
 
-    checks: list[Tuple[str, bool, Optional[str]]] = []
-
-    # Groq
-    if os.getenv("GROQ_API_KEY"):
-        groq_agent = Agent(GroqModel("llama-3.1-8b-instant"))
-        checks.append(await try_run(groq_agent, "Groq llama-3.1-8b-instant"))
-    else:
-        checks.append(("Groq", False, "GROQ_API_KEY not set"))
-
-    # OpenAI
-    if os.getenv("OPENAI_API_KEY"):
-        openai_agent = Agent(OpenAIChatModel("gpt-5-nano"))
-        checks.append(await try_run(openai_agent, "OpenAI gpt-5-nano"))
-    else:
-        checks.append(("OpenAI", False, "OPENAI_API_KEY not set"))
-
-    # # Google / Gemini
-    if os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY"):
-        google_agent = Agent(GoogleModel("gemini-2.5-flash"))
-        checks.append(await try_run(google_agent, "Google Gemini 2.5-flash"))
-    else:
-        checks.append(("Google/Gemini", False, "GOOGLE_API_KEY/GEMINI_API_KEY not set"))
-
-    ok = True
-    print("\nModel check:")
-    for name, success, error in checks:
-        status = "OK" if success else "FAIL"
-        print(f"- {name}: {status}")
-        if error and not success:
-            print(f"  reason: {error}")
-        ok = ok and success
+    reports = await asyncio.gather(
+        *(check_provider(p, max(1, args.repeat), args.timeout) for p in providers(args.base_url, args.model))
+    )
+    ok = all(report.ok for report in reports)
+
+    if args.json_path:
+        payload = json.dumps({"ok": ok, "providers": [asdict(r) for r in reports]}, indent=2)
+        if args.json_path == "-":
+            print(payload)
+        else:
+            with open(args.json_path, "w", encoding="utf-8") as f:
+                f.write(payload)
+
+    if args.json_path != "-":
+        print("\nModel check:")
+        for report in reports:
+            status = "OK" if report.ok else "FAIL"
+            print(f"- {report.name}: {status}")
+            if report.error and not report.ok:
+                print(f"  reason: {report.error}")
+            if report.latency and args.repeat > 1:
+                lat, ttft = report.latency, report.ttft
+                print(
+                    f"  {report.runs - report.failures}/{report.runs} ok"
+                    f" | latency p50 {lat['p50']}s p95 {lat['p95']}s p99 {lat['p99']}s"
+                    f" | ttft p50 {ttft['p50']}s | {report.tokens_per_sec} tok/s"
+                )
 
     return 0 if ok else 1
 
@@ -63,5 +195,3 @@ def main() -> int:
 
 if __name__ == "__main__":
     sys.exit(main())
-
-
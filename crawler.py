@@ -0,0 +1,292 @@
+"""
+Async crawl pipeline for product listing pages.
+
+Seed URLs are fetched through one pooled AsyncClient (HTTP/2 when `h2` is
+installed) and the shared fetch cache, pagination is followed by bumping the
+`page` query parameter, and every host gets its own concurrency and rate limit.
+Pages are streamed to extraction as they arrive, and parsed in the
+`html_parse` process pool so parsing never holds up fetching or model calls.
+
+    python crawler.py URL [URL ...] --max-pages 10
+"""
+import sys
+import asyncio
+import hashlib
+import argparse
+import datetime
+import importlib.util
+from dataclasses import dataclass
+from typing import AsyncIterator
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import httpx
+
+from fetch_cache import CacheMiss, FetchCache
+from html_parse import ParsePool, parse_pool
+from rate_limit import TokenBucket
+from row_writer import open_writer
+from web_scrapping_agent import (
+    HEADERS,
+    PRODUCT_DTYPES,
+    Results,
+    _dedupe_key,
+    candidates_to_results,
+    extract_blocks,
+    fetch_cache,
+)
+
+
+@dataclass
+class Page:
+    url: str
+    page_number: int
+    status_code: int
+    content: bytes
+    encoding: str
+    from_cache: bool
+
+    @property
+    def html(self) -> str:
+        return self.content.decode(self.encoding, errors='replace')
+
+
+class HostLimits:
+    """Per-host concurrency cap plus a token bucket of `rate` requests per second."""
+
+    def __init__(self, concurrency: int, rate: float):
+        self.concurrency = concurrency
+        self.rate = rate
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._buckets: dict[str, TokenBucket] = {}
+
+    def semaphore(self, host: str) -> asyncio.Semaphore:
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.concurrency)
+        return self._semaphores[host]
+
+    def bucket(self, host: str) -> TokenBucket:
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self.rate, capacity=self.concurrency)
+        return self._buckets[host]
+
+
+def page_url(url: str, page: int) -> str:
+    """Returns `url` with its `page` query parameter set to `page`."""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k != 'page']
+    query.append(('page', str(page)))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def start_page(url: str) -> int:
+    for key, value in parse_qsl(urlsplit(url).query):
+        if key == 'page' and value.isdigit():
+            return int(value)
+    return 1
+
+
+def make_client(max_connections: int = 20) -> httpx.AsyncClient:
+    http2 = importlib.util.find_spec('h2') is not None
+    return httpx.AsyncClient(
+        headers=HEADERS,
+        http2=http2,
+        follow_redirects=True,
+        timeout=20,
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+    )
+
+
+async def _fetch(client: httpx.AsyncClient, cache: FetchCache, limits: HostLimits, url: str):
+    host = urlsplit(url).netloc
+    async with limits.semaphore(host):
+        # Only requests that actually go to the network spend rate budget
+        return await cache.afetch(client, url, before_request=limits.bucket(host).wait)
+
+
+async def _follow(
+    seed: str,
+    client: httpx.AsyncClient,
+    cache: FetchCache,
+    limits: HostLimits,
+    max_pages: int,
+    out: asyncio.Queue,
+) -> None:
+    first = start_page(seed)
+    seen_bodies = set()
+    for number in range(first, first + max_pages):
+        url = seed if number == first else page_url(seed, number)
+        try:
+            response = await _fetch(client, cache, limits, url)
+        except (httpx.HTTPError, CacheMiss) as e:
+            print(f'Stopping at {url}: {e}')
+            return
+        if response.status_code != 200:
+            print(f'Stopping at {url}: status {response.status_code}')
+            return
+        digest = hashlib.sha256(response.content).hexdigest()
+        if digest in seen_bodies:
+            # Past the last page, many sites serve the last page again
+            return
+        seen_bodies.add(digest)
+        await out.put(Page(url, number, response.status_code, response.content, response.encoding, response.from_cache))
+
+
+async def crawl(
+    seed_urls: list[str],
+    max_pages: int = 5,
+    per_host_concurrency: int = 2,
+    per_host_rate: float = 1.0,
+    cache: FetchCache = fetch_cache,
+) -> AsyncIterator[Page]:
+    """
+    Crawls every seed and its following pages, yielding pages as they are fetched.
+
+    Args:
+        seed_urls: Listing URLs to start from
+        max_pages: Pages to follow per seed, including the seed itself
+        per_host_concurrency: Requests in flight per host
+        per_host_rate: Network requests per second per host (cache hits are free)
+        cache: Fetch cache the pages go through
+    """
+    limits = HostLimits(per_host_concurrency, per_host_rate)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=per_host_concurrency * 4)
+    done = object()
+
+    async with make_client() as client:
+        async def producer():
+            try:
+                # One seed failing (a malformed URL, a parse error) shouldn't
+                # cancel the others or end the crawl without a word
+                outcomes = await asyncio.gather(
+                    *(_follow(s, client, cache, limits, max_pages, queue) for s in seed_urls),
+                    return_exceptions=True,
+                )
+                for seed, outcome in zip(seed_urls, outcomes):
+                    if isinstance(outcome, Exception):
+                        print(f'Crawl of {seed} failed: {outcome!r}')
+            finally:
+                await queue.put(done)
+
+        task = asyncio.create_task(producer())
+        try:
+            while (page := await queue.get()) is not done:
+                yield page
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+async def extract_page(
+    page: Page,
+    max_chunk_tokens: int,
+    chunk_concurrency: int,
+    parser: ParsePool = parse_pool,
+) -> Results:
+    parsed = await parser.parse(page.content, page.encoding, page.url)
+    results = candidates_to_results(parsed.known)
+    if results is None:
+        results, _ = await extract_blocks(parsed.blocks, max_chunk_tokens, chunk_concurrency)
+    return results
+
+
+async def crawl_and_extract(
+    seed_urls: list[str],
+    max_pages: int = 5,
+    per_host_concurrency: int = 2,
+    per_host_rate: float = 1.0,
+    extract_concurrency: int = 2,
+    chunk_concurrency: int = 4,
+    max_chunk_tokens: int = 2000,
+) -> AsyncIterator[tuple[Page, Results]]:
+    """
+    Streams (page, results) pairs. Extraction of a page starts as soon as it is
+    fetched, while later pages are still downloading. At most
+    `extract_concurrency` pages are extracted at once, each with up to
+    `chunk_concurrency` agent runs, and the next page is only taken from the
+    crawl once one of them finishes.
+    """
+    slots = asyncio.Semaphore(extract_concurrency)
+    finished: asyncio.Queue = asyncio.Queue()
+    pending: set[asyncio.Task] = set()
+
+    async def extract(page: Page):
+        try:
+            results = await extract_page(page, max_chunk_tokens, chunk_concurrency)
+        except Exception as e:  # noqa: BLE001 - one bad page shouldn't stop the crawl
+            print(f'Extraction failed for {page.url}: {e}')
+            results = Results(dataset=[])
+        finally:
+            slots.release()
+        await finished.put((page, results))
+
+    pages = crawl(seed_urls, max_pages, per_host_concurrency, per_host_rate)
+    try:
+        while True:
+            # Take the next page only once an extraction slot is free, so pages
+            # don't pile up in memory behind a slow model
+            await slots.acquire()
+            while not finished.empty():
+                yield finished.get_nowait()
+            page = await anext(pages, None)
+            if page is None:
+                slots.release()
+                break
+            task = asyncio.create_task(extract(page))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+        while pending or not finished.empty():
+            if finished.empty():
+                await asyncio.wait(set(pending), return_when=asyncio.FIRST_COMPLETED)
+                continue
+            yield finished.get_nowait()
+    finally:
+        # The consumer may stop early, don't leave extractions running
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        await pages.aclose()
+
+
+async def amain(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='Crawl listing pages and extract products.')
+    parser.add_argument('urls', nargs='+')
+    parser.add_argument('--max-pages', type=int, default=5)
+    parser.add_argument('--per-host-concurrency', type=int, default=2)
+    parser.add_argument('--per-host-rate', type=float, default=1.0)
+    parser.add_argument('--extract-concurrency', type=int, default=2)
+    parser.add_argument('--chunk-concurrency', type=int, default=4)
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    parser.add_argument('--parquet', action='store_true', help='also write a Parquet file when the crawl finishes')
+    args = parser.parse_args(argv)
+
+    timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    output_path = f"product_listings_{timestamp}.{args.format}"
+    parquet_path = f"product_listings_{timestamp}.parquet" if args.parquet else None
+
+    pages = 0
+    seen = set()
+    with open_writer(output_path, parquet_path, PRODUCT_DTYPES) as writer:
+        async for page, results in crawl_and_extract(
+            args.urls,
+            args.max_pages,
+            args.per_host_concurrency,
+            args.per_host_rate,
+            args.extract_concurrency,
+            args.chunk_concurrency,
+        ):
+            source = 'cache' if page.from_cache else 'network'
+            print(f'{page.url} ({source}): {len(results.dataset)} products')
+            pages += 1
+            # Products are written as their page finishes, so a product listed
+            # on several pages is kept the first time it is seen
+            for product in results.dataset:
+                key = _dedupe_key(product)
+                if key not in seen:
+                    seen.add(key)
+                    writer.write(product)
+    print(f'Wrote {writer.rows} products from {pages} pages to {output_path}')
+
+
+if __name__ == "__main__":
+    asyncio.run(amain(sys.argv[1:]))
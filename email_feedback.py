@@ -1,11 +1,25 @@
 from __future__ import annotations as __annotatiions
+import sys
+import csv
+import json
+import asyncio
+import argparse
+from pathlib import Path
+from typing import Iterable, Iterator
 from dataclasses import dataclass, field
 from pydantic import BaseModel, EmailStr
 from pydantic_ai import Agent
 from pydantic_ai import format_as_xml
 from pydantic_ai.messages import ModelMessage
+from pydantic_ai.usage import RunUsage
 from pydantic_graph import BaseNode, End, Graph, GraphRunContext
-from load_models import GEMINI_MODEL
+from load_models import get_model
+from message_history import compact_history, merge_messages, summarize_feedback
+from rate_limit import TokenBucket
+from row_writer import RowWriter, open_writer
+from graph_store import RunStore
+from graph_profiler import GraphProfiler
+from instrumentation import metrics
 
 @dataclass
 class User:
@@ -17,6 +31,22 @@ class User:
 class State:
     user: User
     write_agent_messages: list[ModelMessage] = field(default_factory=list)
+    feedback_history: list[str] = field(default_factory=list)
+    iterations: int = 0
+    # Upper bound on WriteEmail -> Feedback rounds, the last draft is kept once it is hit
+    max_iterations: int = 3
+    max_history_tokens: int = 4000
+    # Accumulated by every agent run of the graph
+    usage: RunUsage = field(default_factory=RunUsage)
+
+@dataclass
+class FeedbackDeps:
+    # Shared by all concurrent runs, paces agent calls to the provider's rate limit
+    limiter: TokenBucket | None = None
+
+    async def pace(self) -> None:
+        if self.limiter is not None:
+            await self.limiter.wait()
 
 @dataclass
 class Email:
@@ -30,14 +60,14 @@ class EmailOk(BaseModel):
     pass
 
 email_writer_agent = Agent(
-    model=GEMINI_MODEL,
+    model=get_model('gemini'),
     output_type=Email,
     system_prompt='Write a welcome email for the people who subscribe to my tech blog.',
 )
 
 
 feedback_agent = Agent(
-    model=GEMINI_MODEL,
+    model=get_model('gemini'),
     output_type=EmailRequiresWrite | EmailOk,
     system_prompt=(
         'Review the email and provide feedback, email must reference the users specific interests.'
@@ -45,18 +75,26 @@ feedback_agent = Agent(
 )
 
 @dataclass
-class WriteEmail(BaseNode[State]):
+class WriteEmail(BaseNode[State, FeedbackDeps]):
     email_feedback: str | None = None
-    async def run(self, ctx: GraphRunContext[State]) -> Feedback:
+    async def run(self, ctx: GraphRunContext[State, FeedbackDeps]) -> Feedback:
         print('-'*50)
         print('WriteEmail call fired. Email feedback:', self.email_feedback)
         print()
+        ctx.state.iterations += 1
         if self.email_feedback:
             prompt = (
                 f'Rewrite the email for the user:\n'
                 f'{format_as_xml(ctx.state.user)}\n'
                 f'Feedback: {self.email_feedback}'
             )
+            if ctx.state.feedback_history:
+                # Older drafts may have been compacted out of the history
+                prompt += (
+                    f'\nEarlier feedback, keep it addressed:\n'
+                    f'{summarize_feedback(ctx.state.feedback_history)}'
+                )
+            ctx.state.feedback_history.append(self.email_feedback)
         else:
             user_xml = """
             <examples>
@@ -68,29 +106,38 @@ class WriteEmail(BaseNode[State]):
                 f'Write a welcome email for the user:\n'
                 f'{user_xml}'
             )
+        await ctx.deps.pace()
         result = await email_writer_agent.run(
             prompt,
             message_history=ctx.state.write_agent_messages,
+            usage=ctx.state.usage,
         )
         print('WriteEmail result Received. Result:', result.output)
         print('-'*50)
 
-        ctx.state.write_agent_messages += result.all_messages()
+        ctx.state.write_agent_messages = compact_history(
+            merge_messages(ctx.state.write_agent_messages, result.new_messages()),
+            ctx.state.max_history_tokens,
+        )
         return Feedback(result.output)
 
 @dataclass
-class Feedback(BaseNode[State, None, Email]):
+class Feedback(BaseNode[State, FeedbackDeps, Email]):
     email: Email
 
-    async def run(self, ctx: GraphRunContext[State]) -> WriteEmail | End[Email]:
+    async def run(self, ctx: GraphRunContext[State, FeedbackDeps]) -> WriteEmail | End[Email]:
         print('Feedback call fired. Email object received:', self.email)
         print()
 
         prompt = format_as_xml({'user': ctx.state.user, 'email': self.email})
 
-        result = await feedback_agent.run(prompt)
+        await ctx.deps.pace()
+        result = await feedback_agent.run(prompt, usage=ctx.state.usage)
         print('Feedback result received. Feedback result:', result.output)
         if isinstance(result.output, EmailRequiresWrite):
+            if ctx.state.iterations >= ctx.state.max_iterations:
+                print(f'Stopping after {ctx.state.iterations} rewrites, keeping the last draft')
+                return End(self.email)
             return WriteEmail(email_feedback=result.output.feedback)
         else:
             return End(self.email)
@@ -98,13 +145,182 @@ class Feedback(BaseNode[State, None, Email]):
 
 feedback_graph = Graph(nodes=[WriteEmail, Feedback])
 
-user = User(
-    name='Jay',
-    email='jay@example.com',
-    interests=['AI Agent', 'Photography', 'Automation'],
-)
+def read_users(path: str | Path) -> Iterator[User]:
+    """
+    Streams users from a .csv or .jsonl file with name, email and interests.
+    In CSV files interests are separated by ';'.
+    """
+    path = Path(path)
+    with path.open(encoding='utf-8', newline='') as f:
+        if path.suffix.lower() == '.jsonl':
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for row in rows:
+            interests = row.get('interests') or []
+            if isinstance(interests, str):
+                interests = [i.strip() for i in interests.split(';') if i.strip()]
+            yield User(name=row['name'], email=row['email'], interests=interests)
+
+def run_id(user: User) -> str:
+    return user.email.lower()
+
+def _result_row(state: State, email: Email | None, error: str | None) -> dict:
+    return {
+        'name': state.user.name,
+        'email': state.user.email,
+        'subject': email.subject if email else None,
+        'body': email.body if email else None,
+        'iterations': state.iterations,
+        'requests': state.usage.requests,
+        'input_tokens': state.usage.input_tokens,
+        'output_tokens': state.usage.output_tokens,
+        'error': error,
+    }
+
+async def run_user(
+    user: User,
+    deps: FeedbackDeps,
+    max_iterations: int = 3,
+    store: RunStore | None = None,
+    profiler: GraphProfiler | None = None,
+) -> dict:
+    """
+    Runs the feedback graph for one user and returns their result row. With a
+    store the run is persisted after every step, and a user whose run was
+    interrupted or already finished picks up from what was saved. The store's
+    own profiler applies to persisted runs, `profiler` to the rest, a run that
+    goes over budget gets an error row.
+    """
+    state = State(user, max_iterations=max_iterations)
+    email, error = None, None
+    try:
+        if store is None and profiler is not None:
+            report = await profiler.run(feedback_graph, WriteEmail(), state=state, deps=deps)
+            report.raise_for_budget()
+            email = report.output
+        elif store is None:
+            result = await feedback_graph.run(WriteEmail(), state=state, deps=deps)
+            email = result.output
+        else:
+            email, state = await store.run(run_id(user), WriteEmail(), state, deps)
+    except Exception as e:  # noqa: BLE001 - one failed user shouldn't stop the batch
+        error = str(e)
+    return _result_row(state, email, error)
+
+async def resume_run(saved_run_id: str, deps: FeedbackDeps, store: RunStore) -> dict:
+    snapshots = await store.snapshots(saved_run_id)
+    state = snapshots[-1].state
+    email, error = None, None
+    try:
+        email, state = await store.resume(saved_run_id, deps)
+    except Exception as e:  # noqa: BLE001 - one failed user shouldn't stop the batch
+        error = str(e)
+    return _result_row(state, email, error)
+
+async def _run_pool(items: Iterable, run, writer: RowWriter, concurrency: int) -> None:
+    items = iter(items)
+
+    async def worker():
+        # Workers share the iterator, each takes the next item when it is free
+        for item in items:
+            writer.write(await run(item))
+            print(f'{writer.rows} users done')
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+async def run_batch(
+    users: Iterable[User],
+    writer: RowWriter,
+    concurrency: int = 8,
+    rate: float = 1.0,
+    max_iterations: int = 3,
+    store: RunStore | None = None,
+    resume: bool = False,
+    profiler: GraphProfiler | None = None,
+) -> int:
+    """
+    Runs one graph per user on this event loop, at most `concurrency` at a
+    time, and writes each user's row as soon as their run finishes.
+
+    Args:
+        users: Users to email, consumed lazily so large files aren't loaded at once
+        writer: Where result rows go
+        concurrency: Graph runs in flight
+        rate: Agent calls per second across all runs
+        max_iterations: Cap on rewrite rounds per user
+        store: Persists every run so it can be resumed after a crash
+        resume: Finish every unfinished run in `store` before starting on `users`
+        profiler: Step and time budgets for runs that aren't persisted
+
+    Returns:
+        The number of users processed
+    """
+    deps = FeedbackDeps(TokenBucket(rate, capacity=concurrency))
+
+    resumed = set()
+    if store is not None and resume:
+        resumed = set(await store.unfinished())
+        print(f'Resuming {len(resumed)} unfinished runs')
+        await _run_pool(resumed, lambda r: resume_run(r, deps, store), writer, concurrency)
+
+    pending = (u for u in users if run_id(u) not in resumed)
+    await _run_pool(pending, lambda u: run_user(u, deps, max_iterations, store, profiler), writer, concurrency)
+    return writer.rows
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='Write and review welcome emails for subscribers.')
+    parser.add_argument('users', nargs='?', help='.csv or .jsonl file of users, runs a sample user if omitted')
+    parser.add_argument('--output', default='welcome_emails.jsonl', help='.csv or .jsonl results file')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=1.0, help='agent calls per second')
+    parser.add_argument('--max-iterations', type=int, default=3)
+    parser.add_argument('--runs-dir', help='persist every run here so it can be resumed')
+    parser.add_argument('--resume', action='store_true', help='finish unfinished runs in --runs-dir first')
+    parser.add_argument(
+        '--resume-over-budget', action='store_true', help='also resume runs that went over their budget before',
+    )
+    parser.add_argument('--max-steps', type=int, help='graph steps per user, defaults to 2 * (max iterations + 1)')
+    parser.add_argument('--max-seconds', type=float, help='wall time per user run')
+    parser.add_argument('--metrics', help='write model, tool and graph metrics here in the Prometheus text format')
+    args = parser.parse_args(argv)
+
+    profiler = GraphProfiler(
+        max_steps=args.max_steps or 2 * (args.max_iterations + 1),
+        max_seconds=args.max_seconds,
+    )
+    args.resume = args.resume or args.resume_over_budget
+    store = RunStore(args.runs_dir, feedback_graph, profiler, args.resume_over_budget) if args.runs_dir else None
+    if args.resume and store is None:
+        parser.error('--resume needs --runs-dir')
+
+    if args.users is None and not args.resume:
+        user = User(
+            name='Jay',
+            email='jay@example.com',
+            interests=['AI Agent', 'Photography', 'Automation'],
+        )
+        state = State(user, max_iterations=args.max_iterations)
+        report = asyncio.run(profiler.run(feedback_graph, WriteEmail(), state=state, deps=FeedbackDeps()))
+        print(report.output)
+        print(report.format())
+    else:
+        with open_writer(args.output) as writer:
+            count = asyncio.run(run_batch(
+                read_users(args.users) if args.users else [],
+                writer,
+                args.concurrency,
+                args.rate,
+                args.max_iterations,
+                store,
+                args.resume,
+                profiler,
+            ))
+        print(f'Wrote results for {count} users to {args.output}')
 
-state = State(user)
+    if args.metrics:
+        metrics.write_prometheus(args.metrics)
+        print(f'Saved metrics to {args.metrics}')
 
-email = feedback_graph.run_sync(WriteEmail(), state=state)
-print(email)
\ No newline at end of file
+if __name__ == "__main__":
+    main(sys.argv[1:])
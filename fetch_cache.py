@@ -0,0 +1,276 @@
+"""
+On-disk HTTP fetch cache.
+
+Entries are keyed by the normalized URL and point at a content-addressed body
+(bodies are stored once per sha256, so identical pages share storage). Fresh
+entries are served without touching the network, stale ones are revalidated
+with If-None-Match / If-Modified-Since, and the cache is trimmed least
+recently used first once it grows past `max_bytes`. The size of the stored
+bodies is tracked in memory, so the directory is only scanned when a store
+pushes it over the limit.
+
+Modes:
+    default  serve fresh entries, revalidate stale ones
+    refresh  always revalidate, even when fresh
+    offline  only serve what is cached, never touch the network
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import Counter
+from dataclasses import dataclass, asdict, field
+from pathlib import Path
+from typing import Awaitable, Callable
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import httpx
+
+MODES = ('default', 'refresh', 'offline')
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class CacheMiss(Exception):
+    pass
+
+
+@dataclass
+class CacheEntry:
+    url: str
+    status: int
+    headers: dict[str, str]
+    body_sha: str
+    size: int
+    stored_at: float
+    last_used: float = field(default_factory=time.time)
+
+    @property
+    def etag(self) -> str | None:
+        return self.headers.get('etag')
+
+    @property
+    def last_modified(self) -> str | None:
+        return self.headers.get('last-modified')
+
+
+@dataclass
+class CachedResponse:
+    url: str
+    status_code: int
+    headers: dict[str, str]
+    content: bytes
+    from_cache: bool
+
+    @property
+    def encoding(self) -> str:
+        content_type = self.headers.get('content-type', '')
+        for param in content_type.split(';')[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.lower() == 'charset' and value:
+                return value.strip('"')
+        return 'utf-8'
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors='replace')
+
+
+def normalize_url(url: str) -> str:
+    """
+    Canonical form used as the cache key: lower-cased scheme and host, no
+    default port, no fragment, query parameters sorted.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f'{host}:{parts.port}'
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+
+class FetchCache:
+    def __init__(
+        self,
+        directory: str | os.PathLike = '.fetch_cache',
+        ttl: float = 3600,
+        max_bytes: int = 256 * 1024 * 1024,
+        mode: str = 'default',
+    ):
+        if mode not in MODES:
+            raise ValueError(f'mode must be one of {MODES}, got {mode!r}')
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self._entries_dir = self.directory / 'entries'
+        self._objects_dir = self.directory / 'objects'
+        self._lock = threading.Lock()
+        # Bytes of bodies on disk, counted on first store
+        self._total: int | None = None
+
+    # -- storage -----------------------------------------------------------
+
+    def _entry_path(self, url: str) -> Path:
+        key = hashlib.sha256(normalize_url(url).encode()).hexdigest()
+        return self._entries_dir / f'{key}.json'
+
+    def lookup(self, url: str) -> CacheEntry | None:
+        path = self._entry_path(url)
+        try:
+            entry = CacheEntry(**json.loads(path.read_text(encoding='utf-8')))
+        except (FileNotFoundError, json.JSONDecodeError, TypeError):
+            return None
+        if not (self._objects_dir / entry.body_sha).exists():
+            return None
+        return entry
+
+    def read_body(self, entry: CacheEntry) -> bytes:
+        return (self._objects_dir / entry.body_sha).read_bytes()
+
+    def _write_entry(self, entry: CacheEntry) -> None:
+        path = self._entry_path(entry.url)
+        # Created on first write, importing a module that builds a cache
+        # shouldn't leave an empty directory behind
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(asdict(entry)), encoding='utf-8')
+        os.replace(tmp, path)
+
+    def store(self, url: str, status: int, headers: dict[str, str], body: bytes) -> CacheEntry:
+        body_sha = hashlib.sha256(body).hexdigest()
+        object_path = self._objects_dir / body_sha
+        with self._lock:
+            if self._total is None:
+                self._total = self._stored_bytes()
+            if not object_path.exists():
+                self._objects_dir.mkdir(parents=True, exist_ok=True)
+                tmp = object_path.with_suffix('.tmp')
+                tmp.write_bytes(body)
+                os.replace(tmp, object_path)
+                self._total += len(body)
+            now = time.time()
+            entry = CacheEntry(url, status, headers, body_sha, len(body), stored_at=now, last_used=now)
+            self._write_entry(entry)
+            if self._total > self.max_bytes:
+                self.evict()
+        return entry
+
+    def touch(self, entry: CacheEntry, revalidated: bool = False, headers: dict[str, str] | None = None) -> None:
+        entry.last_used = time.time()
+        if revalidated:
+            entry.stored_at = entry.last_used
+            if headers:
+                # A 304 may carry updated validators
+                entry.headers.update({k: v for k, v in headers.items() if k in ('etag', 'last-modified', 'cache-control')})
+        with self._lock:
+            self._write_entry(entry)
+
+    def _stored_bytes(self) -> int:
+        if not self._objects_dir.exists():
+            return 0
+        return sum(path.stat().st_size for path in self._objects_dir.iterdir() if path.suffix != '.tmp')
+
+    def evict(self) -> None:
+        """Drops least recently used entries until the stored bodies fit in max_bytes."""
+        entries = []
+        for path in self._entries_dir.glob('*.json'):
+            try:
+                entries.append((path, CacheEntry(**json.loads(path.read_text(encoding='utf-8')))))
+            except (json.JSONDecodeError, TypeError):
+                path.unlink(missing_ok=True)
+
+        sizes = {entry.body_sha: entry.size for _, entry in entries}
+        refcount = Counter(entry.body_sha for _, entry in entries)
+        total = sum(sizes.values())
+        entries.sort(key=lambda item: item[1].last_used)
+        for path, entry in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            refcount[entry.body_sha] -= 1
+            if refcount[entry.body_sha] == 0:
+                total -= sizes[entry.body_sha]
+
+        referenced = {sha for sha, count in refcount.items() if count > 0}
+        if self._objects_dir.exists():
+            for object_path in self._objects_dir.iterdir():
+                if object_path.name not in referenced:
+                    object_path.unlink(missing_ok=True)
+        self._total = total
+
+    # -- HTTP --------------------------------------------------------------
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.stored_at < self.ttl
+
+    def _plan(self, url: str) -> tuple[CacheEntry | None, dict[str, str] | None]:
+        """
+        Decides how to serve `url`.
+
+        Returns:
+            (entry, None) to serve the entry as is, or (entry or None,
+            request headers) to go to the network
+        """
+        entry = self.lookup(url)
+        if self.mode == 'offline':
+            if entry is None:
+                raise CacheMiss(f'{url} is not cached and the fetch cache is offline')
+            return entry, None
+        if entry is None:
+            return None, {}
+        if self.mode == 'default' and self.is_fresh(entry):
+            return entry, None
+        conditional = {}
+        if entry.etag:
+            conditional['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            conditional['If-Modified-Since'] = entry.last_modified
+        return entry, conditional
+
+    def _hit(self, entry: CacheEntry) -> CachedResponse:
+        body = self.read_body(entry)
+        return CachedResponse(entry.url, entry.status, entry.headers, body, from_cache=True)
+
+    def _complete(self, url: str, entry: CacheEntry | None, response: httpx.Response) -> CachedResponse:
+        headers = {k.lower(): v for k, v in response.headers.items()}
+        if response.status_code == 304 and entry is not None:
+            self.touch(entry, revalidated=True, headers=headers)
+            return self._hit(entry)
+        if response.status_code == 200 and 'no-store' not in headers.get('cache-control', ''):
+            self.store(url, response.status_code, headers, response.content)
+        return CachedResponse(url, response.status_code, headers, response.content, from_cache=False)
+
+    def fetch(self, client: httpx.Client, url: str, **kwargs) -> CachedResponse:
+        entry, conditional = self._plan(url)
+        if conditional is None:
+            self.touch(entry)
+            return self._hit(entry)
+        headers = {**kwargs.pop('headers', {}), **conditional}
+        response = client.get(url, headers=headers, **kwargs)
+        return self._complete(url, entry, response)
+
+    async def afetch(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        before_request: Callable[[], Awaitable[None]] | None = None,
+        **kwargs,
+    ) -> CachedResponse:
+        """
+        Async counterpart of fetch. `before_request` is awaited only when the
+        network is actually used, e.g. to wait on a rate limiter.
+        """
+        entry, conditional = self._plan(url)
+        if conditional is None:
+            self.touch(entry)
+            return self._hit(entry)
+        if before_request is not None:
+            await before_request()
+        headers = {**kwargs.pop('headers', {}), **conditional}
+        response = await client.get(url, headers=headers, **kwargs)
+        # Writing the body, and evicting when it goes over the limit, is disk
+        # work that shouldn't hold up the event loop
+        return await asyncio.to_thread(self._complete, url, entry, response)
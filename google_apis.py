@@ -1,10 +1,72 @@
 import os
+import json
+import time
+import threading
+import httpx
+import googleapiclient
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient.discovery import Resource, build_from_document, DISCOVERY_URI, V2_DISCOVERY_URI
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 
-def create_service(client_secret_file, api_name, api_version, *scopes, prefix=''):
+DISCOVERY_CACHE_DIR = 'discovery_cache'
+# Discovery documents change rarely, refetch them weekly and keep using the
+# cached copy if the refetch fails
+DISCOVERY_MAX_AGE = 7 * 24 * 3600
+
+def _discovery_path(api_name, api_version):
+    # The client library version is part of the name, so upgrading it
+    # invalidates every cached document
+    file_name = f'{api_name}_{api_version}_{googleapiclient.__version__}.json'
+    return os.path.join(os.getcwd(), DISCOVERY_CACHE_DIR, file_name)
+
+def _download_discovery_document(api_name, api_version):
+    last_error = None
+    for uri in (DISCOVERY_URI, V2_DISCOVERY_URI):
+        url = uri.replace('{api}', api_name).replace('{apiVersion}', api_version)
+        try:
+            response = httpx.get(url, timeout=20)
+        except httpx.HTTPError as e:
+            last_error = e
+            continue
+        if response.status_code == 200:
+            return response.text
+        last_error = RuntimeError(f'{url} returned status {response.status_code}')
+    raise last_error
+
+def load_discovery_document(api_name, api_version, max_age=DISCOVERY_MAX_AGE):
+    """
+    Returns the discovery document for an API, from the on-disk cache when it
+    is younger than `max_age` seconds, otherwise downloaded and cached.
+    """
+    path = _discovery_path(api_name, api_version)
+    cached = None
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            cached = f.read()
+        if time.time() - os.path.getmtime(path) < max_age:
+            return cached
+
+    try:
+        document = _download_discovery_document(api_name, api_version)
+    except Exception as e:
+        if cached is None:
+            raise
+        print(f'Using cached discovery document for {api_name} {api_version}: {e}')
+        return cached
+
+    # Only replace the cached copy when the API revision actually changed
+    if cached is not None and json.loads(cached).get('revision') == json.loads(document).get('revision'):
+        os.utime(path)
+        return cached
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(document)
+    os.replace(tmp_path, path)
+    return document
+
+def load_credentials(client_secret_file, api_name, api_version, *scopes, prefix=''):
     CLIENT_SECRET_FILE = client_secret_file
     API_SERVICE_NAME = api_name
     API_VERSION = api_version
@@ -22,7 +84,7 @@ def create_service(client_secret_file, api_name, api_version, *scopes, prefix=''
     token_filepath = os.path.join(working_dir, token_dir, token_file)
     if os.path.exists(token_filepath):
         creds = Credentials.from_authorized_user_file(token_filepath, SCOPES)
-    
+
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
@@ -33,12 +95,57 @@ def create_service(client_secret_file, api_name, api_version, *scopes, prefix=''
         with open(token_filepath, 'w') as token:
             token.write(creds.to_json())
 
+    return creds, token_filepath
+
+def create_service(client_secret_file, api_name, api_version, *scopes, prefix=''):
+    creds, token_filepath = load_credentials(client_secret_file, api_name, api_version, *scopes, prefix=prefix)
+
     try:
-        service = build(API_SERVICE_NAME, API_VERSION, credentials=creds, static_discovery=False)
-        print(API_SERVICE_NAME, API_VERSION, 'service created successfully')
+        service = build_from_document(load_discovery_document(api_name, api_version), credentials=creds)
+        print(api_name, api_version, 'service created successfully')
         return service
     except Exception as e:
         print(e)
-        print(f'Failed to create service instance for {API_SERVICE_NAME}')
-        os.remove(os.path.join(working_dir, token_dir, token_file))
-        return None
\ No newline at end of file
+        print(f'Failed to create service instance for {api_name}')
+        os.remove(token_filepath)
+        return None
+
+class ServicePool:
+    """
+    Hands out one service per thread. googleapiclient services sit on an
+    httplib2 connection that must not be shared between threads, but they can
+    all share one set of credentials, which is refreshed once for the pool.
+    """
+
+    def __init__(self, document, credentials, token_filepath=None):
+        self.document = document
+        self.credentials = credentials
+        self.token_filepath = token_filepath
+        self._local = threading.local()
+        self._refresh_lock = threading.Lock()
+
+    def _ensure_fresh(self):
+        if self.credentials.valid:
+            return
+        with self._refresh_lock:
+            # Another thread may have refreshed while we waited
+            if self.credentials.valid:
+                return
+            self.credentials.refresh(Request())
+            if self.token_filepath:
+                with open(self.token_filepath, 'w') as token:
+                    token.write(self.credentials.to_json())
+
+    def get(self) -> Resource:
+        self._ensure_fresh()
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            service = build_from_document(self.document, credentials=self.credentials)
+            self._local.service = service
+        return service
+
+def create_service_pool(client_secret_file, api_name, api_version, *scopes, prefix=''):
+    creds, token_filepath = load_credentials(client_secret_file, api_name, api_version, *scopes, prefix=prefix)
+    pool = ServicePool(load_discovery_document(api_name, api_version), creds, token_filepath)
+    print(api_name, api_version, 'service pool created successfully')
+    return pool
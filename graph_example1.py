@@ -1,5 +1,7 @@
+import asyncio
 from dataclasses import dataclass
 from pydantic_graph import GraphRunContext, BaseNode, Graph, End
+from graph_profiler import GraphProfiler
 
 
 @dataclass
@@ -34,14 +36,18 @@ class NodeC(BaseNode[int]):
 
 graph = Graph(nodes = [NodeA, NodeB, NodeC])
 
-run_result = graph.run_sync(start_node=NodeA(track_number=4))
-print(run_result)
-print('#' * 40)
-result = run_result.output
-print(result)
-print('#' * 40)
-history = run_result.state
-print(history)
+if __name__ == '__main__':
+    run_result = graph.run_sync(start_node=NodeA(track_number=4))
+    print(run_result)
+    print('#' * 40)
+    result = run_result.output
+    print(result)
+    print('#' * 40)
+    history = run_result.state
+    print(history)
+    print('#' * 40)
+    report = asyncio.run(GraphProfiler(max_steps=10).run(graph, NodeA(track_number=4)))
+    print(report.format())
 
 # print('#' * 40)
 # print('History: ')
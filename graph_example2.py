@@ -25,4 +25,11 @@ class Check42(BaseNode[MyState, None, int]):
 never_42_graph = Graph(nodes=(Increment, Check42))
 
 
-
+if __name__ == '__main__':
+    import asyncio
+    from graph_profiler import GraphProfiler
+
+    # Starting at 41 walks through the Check42 -> Increment loop once, the
+    # budgets stop it if the loop ever stops converging
+    report = asyncio.run(GraphProfiler(max_steps=100, max_seconds=5).run(never_42_graph, Increment(), state=MyState(41)))
+    print(report.format())
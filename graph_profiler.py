@@ -0,0 +1,197 @@
+"""
+Step profiler and runaway-loop guard for pydantic_graph runs.
+
+`GraphProfiler.run` drives any `Graph` one node at a time and records the wall
+time and call count of every node, the serialized size of the state after each
+step and every transition taken. With `max_steps` or `max_seconds` set, a run
+that goes over budget is stopped between steps (or its in-flight node is
+cancelled, for the time budget) and the report says where it was looping.
+
+    profiler = GraphProfiler(max_steps=50, max_seconds=120)
+    report = await profiler.run(never_42_graph, Increment(), state=MyState(1))
+    print(report.format())
+
+Budget stops are counted in `instrumentation.metrics` as
+`graph_budget_exceeded_total` and every finished run is logged as a
+`graph_run` event.
+"""
+import time
+import asyncio
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any
+
+import pydantic_core
+from pydantic_graph import BaseNode, End, Graph
+
+from instrumentation import Metrics, metrics
+
+ENDED = 'ended'
+STEP_BUDGET = 'step_budget'
+TIME_BUDGET = 'time_budget'
+ERROR = 'error'
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, report: 'RunReport'):
+        super().__init__(
+            f'Graph {report.graph} over its {report.status.replace("_", " ")} '
+            f'after {report.steps} steps, stopped at {report.last_node}'
+        )
+        self.report = report
+
+
+def state_size(state: Any) -> int:
+    """Bytes of the state serialized as JSON, roughly what persisting it costs."""
+    if state is None:
+        return 0
+    return len(pydantic_core.to_json(state, fallback=repr))
+
+
+@dataclass
+class NodeProfile:
+    calls: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+
+@dataclass
+class RunReport:
+    graph: str
+    status: str = ENDED
+    steps: int = 0
+    seconds: float = 0.0
+    nodes: dict[str, NodeProfile] = field(default_factory=dict)
+    transitions: Counter = field(default_factory=Counter)
+    state_sizes: list[int] = field(default_factory=list)
+    last_node: str | None = None
+    output: Any = None
+    state: Any = None
+    error: str | None = None
+
+    @property
+    def ended(self) -> bool:
+        return self.status == ENDED
+
+    def raise_for_budget(self) -> None:
+        """For callers that want a budget stop to be an error."""
+        if self.status in (STEP_BUDGET, TIME_BUDGET):
+            raise BudgetExceeded(self)
+
+    def format(self) -> str:
+        lines = [f'Graph {self.graph}: {self.status} after {self.steps} steps in {self.seconds:.3f}s']
+        if self.last_node and not self.ended:
+            lines.append(f'  stopped at {self.last_node}')
+        if self.error:
+            lines.append(f'  error: {self.error}')
+        if self.state_sizes:
+            lines.append(f'  state size: {self.state_sizes[0]} -> {self.state_sizes[-1]} bytes (max {max(self.state_sizes)})')
+        lines.append('  nodes:')
+        for name, profile in sorted(self.nodes.items(), key=lambda item: -item[1].seconds):
+            lines.append(
+                f'    {name:<24} calls={profile.calls:<6} total={profile.seconds:.3f}s '
+                f'mean={profile.seconds / profile.calls:.4f}s max={profile.max_seconds:.4f}s'
+            )
+        lines.append('  transitions:')
+        for (source, target), count in self.transitions.most_common():
+            lines.append(f'    {source} -> {target}: {count}')
+        return '\n'.join(lines)
+
+
+class GraphProfiler:
+    def __init__(
+        self,
+        max_steps: int | None = None,
+        max_seconds: float | None = None,
+        registry: Metrics = metrics,
+    ):
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+        self.registry = registry
+
+    async def run(
+        self,
+        graph: Graph,
+        start_node: BaseNode,
+        state: Any = None,
+        deps: Any = None,
+        persistence: Any = None,
+    ) -> RunReport:
+        """
+        Runs `graph` from `start_node` under the budgets. Going over budget
+        ends the run without raising, check `report.ended`. Errors raised by
+        a node still propagate, after being recorded.
+
+        Returns:
+            The run's report, with its output and final state
+        """
+        # Unnamed graphs are reported by their first node
+        name = graph.name or next(iter(graph.node_defs))
+        report = RunReport(name, state=state)
+        start = time.perf_counter()
+        try:
+            async with graph.iter(
+                start_node, state=state, deps=deps, persistence=persistence, infer_name=False
+            ) as run:
+                node = start_node
+                while not isinstance(node, End):
+                    report.last_node = node.get_node_id()
+                    if self.max_steps is not None and report.steps >= self.max_steps:
+                        report.status = STEP_BUDGET
+                        break
+                    remaining = None
+                    if self.max_seconds is not None:
+                        remaining = self.max_seconds - (time.perf_counter() - start)
+                        if remaining <= 0:
+                            report.status = TIME_BUDGET
+                            break
+
+                    step_start = time.perf_counter()
+                    try:
+                        next_node = await asyncio.wait_for(run.next(node), remaining)
+                    except TimeoutError:
+                        report.status = TIME_BUDGET
+                        break
+                    finally:
+                        report.nodes.setdefault(report.last_node, NodeProfile()).add(time.perf_counter() - step_start)
+                    report.steps += 1
+                    target = 'End' if isinstance(next_node, End) else next_node.get_node_id()
+                    report.transitions[(report.last_node, target)] += 1
+                    report.state_sizes.append(state_size(state))
+                    node = next_node
+
+                if isinstance(node, End):
+                    report.output = node.data
+                    report.last_node = None
+        except Exception as e:
+            report.status = ERROR
+            report.error = repr(e)
+            raise
+        finally:
+            report.seconds = time.perf_counter() - start
+            self._record(report)
+        return report
+
+    def _record(self, report: RunReport) -> None:
+        self.registry.inc('graph_runs_total', graph=report.graph, status=report.status)
+        self.registry.inc('graph_steps_total', report.steps, graph=report.graph)
+        for node, profile in report.nodes.items():
+            self.registry.inc('graph_node_seconds_total', profile.seconds, graph=report.graph, node=node)
+        if report.status in (STEP_BUDGET, TIME_BUDGET):
+            self.registry.inc('graph_budget_exceeded_total', graph=report.graph, reason=report.status)
+            print(report.format())
+        self.registry.event(
+            'graph_run',
+            graph=report.graph,
+            status=report.status,
+            steps=report.steps,
+            duration=report.seconds,
+            last_node=report.last_node,
+            transitions={f'{s}->{t}': n for (s, t), n in report.transitions.items()},
+            error=report.error,
+        )
@@ -0,0 +1,148 @@
+"""
+Durable, resumable graph runs.
+
+Each run gets its own FileStatePersistence file under `directory`. pydantic_graph
+saves the state and the next node there after every step, so when a process
+dies only the step that was in flight is lost. Running a run id again resumes
+it from its last saved node, or returns the stored result straight away if it
+already ended, without any model calls.
+
+    store = RunStore('graph_runs', feedback_graph)
+    output, state = await store.run('jay', WriteEmail(), State(user), deps=deps)
+    for run_id in await store.unfinished():
+        output, state = await store.resume(run_id, deps=deps)
+
+With a `GraphProfiler` every run is profiled and held to its budgets. A run
+that goes over budget raises `BudgetExceeded` and stays unfinished, with a
+`.budget` file next to it recording the steps and seconds it has used. Those
+runs are left out of `unfinished()` and refused by `run()` unless
+`resume_over_budget` is set, so a runaway loop doesn't get a fresh budget
+every time the batch is resumed. `resume()` always runs them.
+"""
+import json
+import dataclasses
+from pathlib import Path
+from typing import Any
+from urllib.parse import quote, unquote
+
+from pydantic_graph import BaseNode, Graph
+from pydantic_graph.persistence import EndSnapshot, NodeSnapshot
+from pydantic_graph.persistence.file import FileStatePersistence
+
+from graph_profiler import ENDED, STEP_BUDGET, TIME_BUDGET, GraphProfiler, RunReport
+
+
+class RunStore:
+    def __init__(
+        self,
+        directory: str | Path,
+        graph: Graph,
+        profiler: GraphProfiler | None = None,
+        resume_over_budget: bool = False,
+    ):
+        self.directory = Path(directory)
+        self.graph = graph
+        self.profiler = profiler
+        self.resume_over_budget = resume_over_budget
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, run_id: str) -> Path:
+        # Percent-encoded rather than replaced, so the file name maps back to
+        # exactly this run id and two ids never share a file
+        return self.directory / f"{quote(run_id, safe='@')}.json"
+
+    def budget_path(self, run_id: str) -> Path:
+        return self.path(run_id).with_suffix('.budget')
+
+    def over_budget(self, run_id: str) -> dict[str, Any] | None:
+        """What an over-budget run has used so far, None if it never went over."""
+        try:
+            return json.loads(self.budget_path(run_id).read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            return None
+
+    def _record_budget(self, run_id: str, report: RunReport) -> None:
+        if report.status == ENDED:
+            self.budget_path(run_id).unlink(missing_ok=True)
+        elif report.status in (STEP_BUDGET, TIME_BUDGET):
+            # Totals across every attempt, each resume starts a new budget
+            used = self.over_budget(run_id) or {'steps': 0, 'seconds': 0.0, 'attempts': 0}
+            used = {
+                'status': report.status,
+                'steps': used['steps'] + report.steps,
+                'seconds': used['seconds'] + report.seconds,
+                'attempts': used['attempts'] + 1,
+                'stopped_at': report.last_node,
+            }
+            self.budget_path(run_id).write_text(json.dumps(used), encoding='utf-8')
+
+    def persistence(self, run_id: str) -> FileStatePersistence:
+        persistence = FileStatePersistence(self.path(run_id))
+        persistence.set_graph_types(self.graph)
+        return persistence
+
+    async def snapshots(self, run_id: str) -> list:
+        if not self.path(run_id).exists():
+            return []
+        return await self.persistence(run_id).load_all()
+
+    async def run(self, run_id: str, start_node: BaseNode, state: Any, deps: Any = None) -> tuple[Any, Any]:
+        """
+        Runs `run_id` to the end, starting fresh, resuming, or returning the
+        stored result depending on what is saved for it.
+
+        Returns:
+            The run's output and final state
+        """
+        snapshots = await self.snapshots(run_id)
+        if snapshots:
+            used = self.over_budget(run_id)
+            if used is not None and not self.resume_over_budget and not isinstance(snapshots[-1], EndSnapshot):
+                raise RuntimeError(
+                    f"Run {run_id!r} went over its budget ({used['steps']} steps, {used['seconds']:.1f}s so far), "
+                    'resume it explicitly'
+                )
+            return await self._continue(run_id, snapshots, deps)
+        return await self._run_graph(run_id, start_node, state, deps)
+
+    async def resume(self, run_id: str, deps: Any = None) -> tuple[Any, Any]:
+        snapshots = await self.snapshots(run_id)
+        if not snapshots:
+            raise LookupError(f'No saved run {run_id!r}')
+        return await self._continue(run_id, snapshots, deps)
+
+    async def _continue(self, run_id: str, snapshots: list, deps: Any) -> tuple[Any, Any]:
+        last = snapshots[-1]
+        if isinstance(last, EndSnapshot):
+            return last.result.data, last.state
+
+        node_snapshot = next(s for s in reversed(snapshots) if isinstance(s, NodeSnapshot))
+        # A copy gets a new snapshot id, the saved one may be marked running or
+        # failed by the process that died, and those can't be run again
+        node = dataclasses.replace(node_snapshot.node)
+        print(f'Resuming {run_id} at {node.get_node_id()}')
+        return await self._run_graph(run_id, node, node_snapshot.state, deps)
+
+    async def _run_graph(self, run_id: str, node: BaseNode, state: Any, deps: Any) -> tuple[Any, Any]:
+        if self.profiler is None:
+            result = await self.graph.run(node, state=state, deps=deps, persistence=self.persistence(run_id))
+            return result.output, result.state
+        report = await self.profiler.run(self.graph, node, state=state, deps=deps, persistence=self.persistence(run_id))
+        self._record_budget(run_id, report)
+        report.raise_for_budget()
+        return report.output, report.state
+
+    async def unfinished(self) -> list[str]:
+        """
+        Ids of every saved run that hasn't reached End, leaving out runs that
+        went over budget unless `resume_over_budget` is set.
+        """
+        run_ids = []
+        for path in sorted(self.directory.glob('*.json')):
+            run_id = unquote(path.stem)
+            if not self.resume_over_budget and self.budget_path(run_id).exists():
+                continue
+            snapshots = await self.snapshots(run_id)
+            if snapshots and not isinstance(snapshots[-1], EndSnapshot):
+                run_ids.append(run_id)
+        return run_ids
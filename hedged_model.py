@@ -0,0 +1,220 @@
+"""
+Latency-aware routing with hedged requests across providers.
+
+`HedgedModel` keeps per-provider latency and error statistics and sends each
+request to the healthiest provider first. If no answer has come back after
+that provider's observed p95 latency (clamped to [min_delay, max_delay]), a
+second, hedged request goes to the next provider and whichever succeeds first
+is used, the other is cancelled. A failure starts the next provider right
+away. Streamed requests are not hedged, they go to the healthiest provider and
+fall back in order if the stream can't be opened.
+
+    model = HedgedModel(get_model('groq'), get_model('openai'), get_model('gemini'))
+"""
+import time
+import asyncio
+from collections import defaultdict, deque
+from collections.abc import AsyncIterator
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any
+
+from pydantic_ai.exceptions import FallbackExceptionGroup
+from pydantic_ai.messages import ModelMessage, ModelResponse
+from pydantic_ai.models import Model, ModelRequestParameters, StreamedResponse
+from pydantic_ai.settings import ModelSettings, merge_model_settings
+
+from instrumentation import percentile
+
+# Error rate is weighted heavily, a provider failing one request in ten ranks
+# below one that is twice as slow
+ERROR_PENALTY = 10.0
+
+
+@dataclass
+class ProviderStats:
+    latencies: deque = field(default_factory=lambda: deque(maxlen=200))
+    outcomes: deque = field(default_factory=lambda: deque(maxlen=100))
+    in_flight: int = 0
+
+    def record(self, latency: float | None, error: bool) -> None:
+        self.outcomes.append(error)
+        if latency is not None:
+            self.latencies.append(latency)
+
+    def quantile(self, q: float) -> float | None:
+        return percentile(list(self.latencies), q)
+
+    @property
+    def error_rate(self) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def score(self, default_latency: float) -> float:
+        """Lower is healthier."""
+        p95 = self.quantile(0.95)
+        return (p95 if p95 is not None else default_latency) * (1 + ERROR_PENALTY * self.error_rate)
+
+
+# Keyed by model name, so every router over the same provider learns from the
+# same traffic
+provider_stats: dict[str, ProviderStats] = defaultdict(ProviderStats)
+
+
+class HedgedModel(Model):
+    def __init__(
+        self,
+        *models: Model,
+        min_delay: float = 0.25,
+        max_delay: float = 10.0,
+        default_delay: float = 2.0,
+        quantile: float = 0.95,
+        max_hedges: int = 1,
+        stats: dict[str, ProviderStats] = provider_stats,
+    ):
+        if len(models) < 1:
+            raise ValueError('HedgedModel needs at least one model')
+        super().__init__()
+        self.models = list(models)
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.default_delay = default_delay
+        self.quantile = quantile
+        self.max_hedges = max_hedges
+        self.stats = stats
+        # How often the hedge fired, and how often it beat the first request
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @property
+    def model_name(self) -> str:
+        return f'hedged:{",".join(m.model_name for m in self.models)}'
+
+    @property
+    def system(self) -> str:
+        return f'hedged:{",".join(m.system for m in self.models)}'
+
+    def ranked(self) -> list[Model]:
+        """Models healthiest first, ties keep the configured order."""
+        return sorted(self.models, key=lambda m: self.stats[m.model_name].score(self.default_delay))
+
+    def hedge_delay(self, model: Model) -> float:
+        observed = self.stats[model.model_name].quantile(self.quantile)
+        delay = observed if observed is not None else self.default_delay
+        return min(self.max_delay, max(self.min_delay, delay))
+
+    async def _timed_request(
+        self,
+        model: Model,
+        messages: list[ModelMessage],
+        model_settings: ModelSettings | None,
+        model_request_parameters: ModelRequestParameters,
+    ) -> ModelResponse:
+        stats = self.stats[model.model_name]
+        stats.in_flight += 1
+        start = time.perf_counter()
+        try:
+            response = await model.request(
+                messages,
+                merge_model_settings(model.settings, model_settings),
+                model.customize_request_parameters(model_request_parameters),
+            )
+        except asyncio.CancelledError:
+            # Lost the race, says nothing about the provider's health
+            raise
+        except Exception:
+            stats.record(None, error=True)
+            raise
+        finally:
+            stats.in_flight -= 1
+        stats.record(time.perf_counter() - start, error=False)
+        return response
+
+    async def request(
+        self,
+        messages: list[ModelMessage],
+        model_settings: ModelSettings | None,
+        model_request_parameters: ModelRequestParameters,
+    ) -> ModelResponse:
+        candidates = iter(self.ranked())
+        running: dict[asyncio.Task, Model] = {}
+        # Requests sent because the one before was slow, not because it failed
+        hedge_tasks: set[asyncio.Task] = set()
+        errors: list[Exception] = []
+        hedges = 0
+
+        def start_next(hedge: bool = False) -> bool:
+            model = next(candidates, None)
+            if model is None:
+                return False
+            task = asyncio.create_task(self._timed_request(model, messages, model_settings, model_request_parameters))
+            running[task] = model
+            if hedge:
+                hedge_tasks.add(task)
+            return True
+
+        start_next()
+        try:
+            while running:
+                # Only wait out the hedge delay while a hedge can still be sent
+                timeout = None
+                if len(running) == 1 and hedges < self.max_hedges:
+                    timeout = self.hedge_delay(next(iter(running.values())))
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    if start_next(hedge=True):
+                        hedges += 1
+                        self.hedges += 1
+                    else:
+                        hedges = self.max_hedges
+                    continue
+
+                for task in done:
+                    running.pop(task)
+                    if task.exception() is None:
+                        if task in hedge_tasks:
+                            self.hedge_wins += 1
+                        return task.result()
+                    errors.append(task.exception())
+                if not running:
+                    start_next()
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+        raise FallbackExceptionGroup('All models from HedgedModel failed', errors)
+
+    @asynccontextmanager
+    async def request_stream(
+        self,
+        messages: list[ModelMessage],
+        model_settings: ModelSettings | None,
+        model_request_parameters: ModelRequestParameters,
+        run_context: Any = None,
+    ) -> AsyncIterator[StreamedResponse]:
+        errors: list[Exception] = []
+        for model in self.ranked():
+            stats = self.stats[model.model_name]
+            async with AsyncExitStack() as stack:
+                start = time.perf_counter()
+                try:
+                    response = await stack.enter_async_context(
+                        model.request_stream(
+                            messages,
+                            merge_model_settings(model.settings, model_settings),
+                            model.customize_request_parameters(model_request_parameters),
+                            run_context,
+                        )
+                    )
+                except Exception as e:
+                    stats.record(None, error=True)
+                    errors.append(e)
+                    continue
+                # Time to first byte, that is what the stream's latency means to callers
+                stats.record(time.perf_counter() - start, error=False)
+                yield response
+                return
+
+        raise FallbackExceptionGroup('All models from HedgedModel failed', errors)
@@ -0,0 +1,117 @@
+"""
+HTML parsing stage for the scraper.
+
+Pages are parsed with lxml when it is installed (several times faster than
+the pure-Python 'html.parser'), or whatever HTML_PARSER names. Parsing and
+text cleanup run in a process pool so a crawl uses every core and the event
+loop keeps fetching and calling the model meanwhile. Pages go to the workers
+as the raw response bytes, which pickle as a single buffer copy, and are
+decoded by the parser itself rather than turned into a str first.
+
+One soup per page serves all three consumers: known-site rules, the product
+card lines for the agent tool and the blocks for chunked extraction.
+
+    parsed = await parse_pool.parse(response.content, response.encoding, url)
+
+HTML_PARSE_WORKERS sets the pool size (default: CPU count), 0 parses on a
+thread in this process instead.
+"""
+import os
+import re
+import asyncio
+import importlib.util
+import multiprocessing
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from bs4 import BeautifulSoup
+
+from product_cards import Candidate, extract_candidates, extract_known_site, format_candidates
+
+PARSER = os.getenv('HTML_PARSER') or ('lxml' if importlib.util.find_spec('lxml') else 'html.parser')
+
+
+def make_soup(content: bytes | str, encoding: str | None = None) -> BeautifulSoup:
+    if isinstance(content, bytes):
+        return BeautifulSoup(content, PARSER, from_encoding=encoding)
+    return BeautifulSoup(content, PARSER)
+
+
+def soup_to_text(soup: BeautifulSoup, candidates: list[Candidate]) -> str:
+    """
+    One compact line per product card when the page has a repeated card
+    structure, otherwise the page's flat text.
+    """
+    if candidates:
+        return format_candidates(candidates)
+    return soup.get_text().replace('\n', '').replace('\r', '')
+
+
+def soup_to_blocks(soup: BeautifulSoup, candidates: list[Candidate]) -> list[str]:
+    """Blocks that each hold at most one product."""
+    if candidates:
+        return [c.to_line() for c in candidates]
+
+    text = soup.get_text().replace('\r', '')
+    # Use the widest gap the page has between blocks of text, products on
+    # listing pages are separated by more blank lines than their own fields
+    for separator in (r'\n\s*\n\s*\n+', r'\n\s*\n+', r'\n+'):
+        blocks = [b for b in re.split(separator, text) if b.strip()]
+        if len(blocks) > 1:
+            break
+    return [' '.join(line.strip() for line in b.splitlines() if line.strip()) for b in blocks]
+
+
+@dataclass
+class ParsedPage:
+    text: str
+    blocks: list[str]
+    known: list[Candidate] = field(default_factory=list)
+    cards: int = 0
+
+
+def parse_page(content: bytes | str, encoding: str | None = None, url: str = '') -> ParsedPage:
+    """Parses a page once and derives everything the scraper needs from it."""
+    soup = make_soup(content, encoding)
+    known = extract_known_site(url, soup) if url else []
+    candidates = extract_candidates(soup)
+    return ParsedPage(
+        text=soup_to_text(soup, candidates),
+        blocks=soup_to_blocks(soup, candidates),
+        known=known,
+        cards=len(candidates),
+    )
+
+
+class ParsePool:
+    def __init__(self, max_workers: int | None = None):
+        self.max_workers = max_workers
+        self._executor: Executor | None = None
+
+    def executor(self) -> Executor:
+        # Started on first use, importing the scraper shouldn't spawn processes
+        if self._executor is None:
+            if self.max_workers == 0:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='html-parse')
+            else:
+                # forkserver, forking a process that already runs threads can deadlock
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('forkserver'),
+                )
+        return self._executor
+
+    def submit(self, content: bytes | str, encoding: str | None = None, url: str = '') -> Future:
+        return self.executor().submit(parse_page, content, encoding, url)
+
+    async def parse(self, content: bytes | str, encoding: str | None = None, url: str = '') -> ParsedPage:
+        return await asyncio.wrap_future(self.submit(content, encoding, url))
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+_workers = os.getenv('HTML_PARSE_WORKERS')
+parse_pool = ParsePool(int(_workers) if _workers else None)
@@ -0,0 +1,276 @@
+"""
+Shared run instrumentation for the agents.
+
+Records per-request model latency, input/output tokens, estimated cost and
+retries (retry prompts sent back to the model, from `ModelRetry` or output
+validation), plus per-tool execution time and `ModelRetry` raises. Everything
+lands in one `Metrics` registry that keeps Prometheus-style histograms and
+counters and, when AGENT_METRICS_LOG is set, appends each event to that file
+as a JSON line.
+
+Models from `load_models.get_model` are wrapped in `InstrumentedModel`
+automatically (set AGENT_METRICS=off to disable). Tools opt in with the
+`instrumented_tool` decorator, placed under the agent's tool decorator:
+
+    @weather_agent.tool
+    @instrumented_tool
+    def get_weather(ctx: RunContext[Deps], lat: float, lng: float) -> dict: ...
+
+    print(metrics.to_prometheus())
+
+Set AGENT_METRICS_PROMETHEUS to a file path to have the registry written
+there in the Prometheus text format when the process exits. Responses
+replayed by `model_cache` count as requests and tokens, but not as cost.
+"""
+import os
+import json
+import math
+import atexit
+import time
+import bisect
+import inspect
+import functools
+import threading
+from collections import defaultdict
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, Callable
+
+from pydantic_ai import ModelRetry
+from pydantic_ai.messages import ModelMessage, ModelRequest, ModelResponse, RetryPromptPart
+from pydantic_ai.models import Model, ModelRequestParameters, StreamedResponse
+from pydantic_ai.models.wrapper import WrapperModel
+from pydantic_ai.settings import ModelSettings
+
+from model_cache import is_cache_hit
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+# USD per million input / output tokens, used for cost estimates only
+PRICES: dict[str, tuple[float, float]] = {
+    'gpt-5-nano': (0.05, 0.40),
+    'gemini-2.5-flash': (0.30, 2.50),
+    'llama-3.1-8b-instant': (0.05, 0.08),
+}
+
+
+def estimate_cost(model_name: str, input_tokens: int, output_tokens: int) -> float | None:
+    price = PRICES.get(model_name)
+    if price is None:
+        return None
+    return (input_tokens * price[0] + output_tokens * price[1]) / 1_000_000
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    """Nearest-rank percentile, `q` between 0 and 1, None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1))]
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels: dict[str, str], **extra: str) -> str:
+    items = {**labels, **extra}
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in sorted(items.items())) + '}'
+
+
+class Metrics:
+    def __init__(self, log_path: str | Path | None = None):
+        self.log_path = Path(log_path) if log_path else None
+        self._histograms: dict[tuple[str, tuple], Histogram] = {}
+        self._counters: dict[tuple[str, tuple], float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, buckets: tuple[float, ...] = LATENCY_BUCKETS, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            self._histograms[key].observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def event(self, kind: str, **fields: Any) -> None:
+        """Appends one JSON line to the log, if there is one."""
+        if self.log_path is None:
+            return
+        line = json.dumps({'ts': time.time(), 'event': kind, **fields}, default=str)
+        with self._lock, self.log_path.open('a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+    def total(self, name: str) -> float:
+        """Sum of a counter, or of a histogram's observations, across all labels."""
+        with self._lock:
+            if any(n == name for n, _ in self._histograms):
+                return sum(h.sum for (n, _), h in self._histograms.items() if n == name)
+            return sum(v for (n, _), v in self._counters.items() if n == name)
+
+    def to_prometheus(self) -> str:
+        """Renders every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name in sorted({n for n, _ in self._counters}):
+                lines.append(f'# TYPE {name} counter')
+                for (n, labels), value in sorted(self._counters.items()):
+                    if n == name:
+                        lines.append(f'{name}{_labels(dict(labels))} {value:g}')
+            for name in sorted({n for n, _ in self._histograms}):
+                lines.append(f'# TYPE {name} histogram')
+                for (n, labels), hist in sorted(self._histograms.items(), key=lambda item: item[0]):
+                    if n != name:
+                        continue
+                    labels = dict(labels)
+                    cumulative = 0
+                    for bound, count in zip((*hist.buckets, '+Inf'), hist.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_labels(labels, le=str(bound))} {cumulative}')
+                    lines.append(f'{name}_sum{_labels(labels)} {hist.sum:g}')
+                    lines.append(f'{name}_count{_labels(labels)} {hist.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str | Path) -> None:
+        Path(path).write_text(self.to_prometheus(), encoding='utf-8')
+
+
+metrics = Metrics(os.getenv('AGENT_METRICS_LOG'))
+if os.getenv('AGENT_METRICS_PROMETHEUS'):
+    atexit.register(metrics.write_prometheus, os.environ['AGENT_METRICS_PROMETHEUS'])
+
+
+def _retry_prompts(messages: list[ModelMessage]) -> int:
+    # Only the latest request, earlier ones were counted when they were sent
+    if not messages or not isinstance(messages[-1], ModelRequest):
+        return 0
+    return sum(isinstance(part, RetryPromptPart) for part in messages[-1].parts)
+
+
+class InstrumentedModel(WrapperModel):
+    def __init__(self, wrapped: Model, registry: Metrics = metrics):
+        super().__init__(wrapped)
+        self.registry = registry
+
+    def _record(
+        self,
+        messages: list[ModelMessage],
+        response: ModelResponse | None,
+        duration: float,
+        error: BaseException | None,
+    ) -> None:
+        model = self.wrapped.model_name
+        retries = _retry_prompts(messages)
+        self.registry.observe('agent_model_request_seconds', duration, model=model)
+        self.registry.inc('agent_model_requests_total', model=model, status='error' if error else 'ok')
+        if retries:
+            self.registry.inc('agent_model_retries_total', retries, model=model)
+
+        fields: dict[str, Any] = {'model': model, 'duration': duration, 'retries': retries}
+        if response is not None:
+            usage = response.usage
+            cached = is_cache_hit(response)
+            # Replayed responses weren't paid for again
+            cost = None if cached else estimate_cost(model, usage.input_tokens, usage.output_tokens)
+            self.registry.observe('agent_input_tokens', usage.input_tokens, TOKEN_BUCKETS, model=model)
+            self.registry.observe('agent_output_tokens', usage.output_tokens, TOKEN_BUCKETS, model=model)
+            self.registry.inc('agent_tokens_total', usage.input_tokens, model=model, direction='input')
+            self.registry.inc('agent_tokens_total', usage.output_tokens, model=model, direction='output')
+            if cost is not None:
+                self.registry.inc('agent_cost_usd_total', cost, model=model)
+            fields.update(input_tokens=usage.input_tokens, output_tokens=usage.output_tokens, cost_usd=cost, cached=cached)
+        if error is not None:
+            fields['error'] = repr(error)
+        self.registry.event('model_request', **fields)
+
+    async def request(
+        self,
+        messages: list[ModelMessage],
+        model_settings: ModelSettings | None,
+        model_request_parameters: ModelRequestParameters,
+    ) -> ModelResponse:
+        start = time.perf_counter()
+        try:
+            response = await self.wrapped.request(messages, model_settings, model_request_parameters)
+        except Exception as e:
+            self._record(messages, None, time.perf_counter() - start, e)
+            raise
+        self._record(messages, response, time.perf_counter() - start, None)
+        return response
+
+    @asynccontextmanager
+    async def request_stream(
+        self,
+        messages: list[ModelMessage],
+        model_settings: ModelSettings | None,
+        model_request_parameters: ModelRequestParameters,
+        run_context=None,
+    ) -> AsyncIterator[StreamedResponse]:
+        start = time.perf_counter()
+        try:
+            async with self.wrapped.request_stream(
+                messages, model_settings, model_request_parameters, run_context
+            ) as stream:
+                yield stream
+        except Exception as e:
+            self._record(messages, None, time.perf_counter() - start, e)
+            raise
+        self._record(messages, stream.get(), time.perf_counter() - start, None)
+
+
+def instrumented_tool(fn: Callable | None = None, *, registry: Metrics = metrics):
+    """Times a tool function and counts its ModelRetry raises and errors."""
+    def decorate(fn: Callable) -> Callable:
+        tool = fn.__name__
+
+        def record(start: float, status: str) -> None:
+            duration = time.perf_counter() - start
+            registry.observe('agent_tool_seconds', duration, tool=tool)
+            registry.inc('agent_tool_calls_total', tool=tool, status=status)
+            registry.event('tool_call', tool=tool, duration=duration, status=status)
+
+        def status_of(error: BaseException) -> str:
+            return 'retry' if isinstance(error, ModelRetry) else 'error'
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    result = await fn(*args, **kwargs)
+                except Exception as e:
+                    record(start, status_of(e))
+                    raise
+                record(start, 'ok')
+                return result
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    record(start, status_of(e))
+                    raise
+                record(start, 'ok')
+                return result
+        return wrapper
+
+    return decorate(fn) if fn is not None else decorate
+
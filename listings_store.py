@@ -0,0 +1,263 @@
+"""
+Typed product listings with an append-only price history.
+
+Scraped rows are normalized with vectorized pandas string operations: prices
+like '₹21,219' become floats, rating counts like '1,234 Ratings' become
+nullable ints, and each product is keyed by its normalized brand and name so
+repeats within a snapshot collapse into one row.
+
+Every snapshot is written once to its own Parquet file under
+`history/date=YYYY-MM-DD/`, and nothing is rewritten afterwards. Comparing
+two snapshots only reads those two files, so "what changed since the last
+run" stays fast however much history there is.
+
+    store = ListingsStore('listings')
+    store.import_files(sorted(Path('.').glob('product_listings_*.csv')))
+    print(store.changes())
+
+    python listings_store.py listings add product_listings_2025-09-09_13-00-23.csv
+    python listings_store.py listings changes --since 2025-09-01
+"""
+import re
+import sys
+import argparse
+import datetime
+import importlib.util
+from pathlib import Path
+from typing import Iterable
+
+import pandas as pd
+
+from product_cards import COUNT_RE
+
+COLUMNS = ['key', 'brand', 'product_name', 'price', 'price_text', 'rating_count', 'snapshot']
+# product_listings_2025-09-09_13-00-23.csv, as written by web_scrapping_agent
+FILE_TIMESTAMP_RE = re.compile(r'(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})')
+SNAPSHOT_FORMAT = '%Y%m%dT%H%M%S'
+
+
+def _normalize_text(values: pd.Series) -> pd.Series:
+    return (
+        values.astype('string')
+        .fillna('')
+        .str.lower()
+        .str.replace(r'[^\w]+', ' ', regex=True)
+        .str.strip()
+    )
+
+
+def _rating_counts(text: pd.Series) -> pd.Series:
+    # A bare whole number is a count already, as the scraper writes it. Other
+    # text goes through product_cards.COUNT_RE, so '4.5 (1,234)' is 1234
+    # rather than the star rating
+    plain = pd.to_numeric(text.str.replace(',', '', regex=False).str.strip(), errors='coerce')
+    plain = plain.where(plain % 1 == 0)
+    matched = text.str.extract(COUNT_RE)
+    counted = pd.to_numeric(matched[0].fillna(matched[1]).str.replace(',', '', regex=False), errors='coerce')
+    return plain.fillna(counted).astype('Int64')
+
+
+def normalize(frame: pd.DataFrame, snapshot: datetime.datetime) -> pd.DataFrame:
+    """
+    Types and deduplicates one snapshot of scraped rows.
+
+    Args:
+        frame: Rows with brand (or the scraper's `bramd_name`), product_name,
+            price and rating_count columns
+        snapshot: When the rows were scraped
+
+    Returns:
+        One row per product, in COLUMNS order
+    """
+    frame = frame.rename(columns={'bramd_name': 'brand'})
+    brand = frame['brand'].astype('string').str.strip()
+    name = frame['product_name'].astype('string').str.strip()
+    price_text = frame['price'].astype('string').str.strip()
+    rating_text = frame['rating_count'].astype('string')
+
+    typed = pd.DataFrame({
+        'key': _normalize_text(brand) + '|' + _normalize_text(name),
+        'brand': brand,
+        'product_name': name,
+        # The first number in the text, so 'Rs. 1,299' is 1299 and a sale
+        # price followed by the list price and a discount keeps the sale price
+        'price': pd.to_numeric(
+            price_text.str.extract(r'(\d[\d,]*(?:\.\d+)?)', expand=False).str.replace(',', '', regex=False),
+            errors='coerce',
+        ).astype('float64'),
+        'price_text': price_text,
+        'rating_count': _rating_counts(rating_text),
+    })
+    typed = typed[typed['key'] != '|']
+    # first() takes the first non-null value of each column, so a duplicate
+    # that has a rating count fills in one that didn't
+    typed = typed.groupby('key', sort=False, as_index=False).first()
+    typed = typed.astype({'price': 'float64', 'rating_count': 'Int64'})
+    typed['snapshot'] = pd.Timestamp(snapshot)
+    return typed[COLUMNS]
+
+
+def read_listings(path: str | Path) -> pd.DataFrame:
+    """Reads a scraper output file, .csv or .jsonl."""
+    path = Path(path)
+    if path.suffix == '.jsonl':
+        return pd.read_json(path, lines=True, dtype=False)
+    return pd.read_csv(path, dtype=str, keep_default_na=False, na_values=[''])
+
+
+def file_timestamp(path: str | Path) -> datetime.datetime | None:
+    match = FILE_TIMESTAMP_RE.search(Path(path).name)
+    if match is None:
+        return None
+    return datetime.datetime.strptime(match.group(1), '%Y-%m-%d_%H-%M-%S')
+
+
+class ListingsStore:
+    def __init__(self, directory: str | Path):
+        if importlib.util.find_spec('pyarrow') is None:
+            raise ImportError('ListingsStore stores Parquet and requires pyarrow, install it with `pip install pyarrow`')
+        self.directory = Path(directory)
+        self.history = self.directory / 'history'
+        self.history.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, snapshot: datetime.datetime) -> Path:
+        return self.history / f'date={snapshot:%Y-%m-%d}' / f'snapshot-{snapshot.strftime(SNAPSHOT_FORMAT)}.parquet'
+
+    def snapshots(self) -> list[datetime.datetime]:
+        """Every stored snapshot, oldest first, from file names alone."""
+        return sorted(
+            datetime.datetime.strptime(path.stem.removeprefix('snapshot-'), SNAPSHOT_FORMAT)
+            for path in self.history.glob('date=*/snapshot-*.parquet')
+        )
+
+    def add(self, frame: pd.DataFrame, snapshot: datetime.datetime | None = None) -> pd.DataFrame:
+        """
+        Stores `frame` as a new snapshot.
+
+        Returns:
+            What changed since the snapshot before it
+        """
+        snapshot = (snapshot or datetime.datetime.now()).replace(microsecond=0)
+        path = self._path(snapshot)
+        if path.exists():
+            raise FileExistsError(f'Snapshot {snapshot} is already stored')
+        typed = normalize(frame, snapshot)
+        path.parent.mkdir(exist_ok=True)
+        # Written under a temporary name so a crash never leaves half a snapshot
+        tmp = path.with_suffix('.tmp')
+        typed.to_parquet(tmp, index=False)
+        tmp.replace(path)
+        return self.changes(until=snapshot)
+
+    def import_files(self, paths: Iterable[str | Path]) -> int:
+        """
+        Backfills scraper output files, each as the snapshot its file name is
+        timestamped with. Files already imported are skipped.
+        """
+        imported = 0
+        for path in paths:
+            snapshot = file_timestamp(path) or datetime.datetime.fromtimestamp(Path(path).stat().st_mtime)
+            if self._path(snapshot.replace(microsecond=0)).exists():
+                continue
+            self.add(read_listings(path), snapshot)
+            imported += 1
+        return imported
+
+    def load(self, snapshot: datetime.datetime) -> pd.DataFrame:
+        return pd.read_parquet(self._path(snapshot))
+
+    def latest(self) -> pd.DataFrame:
+        snapshots = self.snapshots()
+        if not snapshots:
+            return pd.DataFrame(columns=COLUMNS)
+        return self.load(snapshots[-1])
+
+    def _at(self, when: datetime.datetime, snapshots: list[datetime.datetime]) -> datetime.datetime | None:
+        # Latest snapshot taken at or before `when`
+        earlier = [s for s in snapshots if s <= when]
+        return earlier[-1] if earlier else None
+
+    def changes(
+        self,
+        since: datetime.datetime | None = None,
+        until: datetime.datetime | None = None,
+    ) -> pd.DataFrame:
+        """
+        Products added, removed, repriced or re-rated between two snapshots,
+        reading only those two files.
+
+        Args:
+            since: Compare against the snapshot in effect at this time,
+                defaults to the one before `until`
+            until: Compare the snapshot in effect at this time, defaults to
+                the latest
+
+        Returns:
+            One row per changed product with its status and old and new values
+        """
+        snapshots = self.snapshots()
+        new_at = self._at(until, snapshots) if until else (snapshots[-1] if snapshots else None)
+        if new_at is None:
+            return _diff(pd.DataFrame(columns=COLUMNS), pd.DataFrame(columns=COLUMNS))
+        if since is None:
+            index = snapshots.index(new_at)
+            old_at = snapshots[index - 1] if index else None
+        else:
+            old_at = self._at(since, snapshots)
+        old = self.load(old_at) if old_at else pd.DataFrame(columns=COLUMNS)
+        return _diff(old, self.load(new_at))
+
+    def price_history(self, brand: str, product_name: str) -> pd.DataFrame:
+        """Every stored observation of one product, oldest first."""
+        key = _normalize_text(pd.Series([brand])) + '|' + _normalize_text(pd.Series([product_name]))
+        history = pd.read_parquet(self.history, filters=[('key', '==', key.iloc[0])])
+        return history.sort_values('snapshot')[['snapshot', 'price', 'price_text', 'rating_count']]
+
+
+def _diff(old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    merged = old[['key', 'brand', 'product_name', 'price', 'rating_count']].merge(
+        new[['key', 'brand', 'product_name', 'price', 'rating_count']],
+        on='key', how='outer', suffixes=('_old', '_new'), indicator=True,
+    )
+    price_changed = (merged['price_old'] != merged['price_new']) & ~(merged['price_old'].isna() & merged['price_new'].isna())
+    rating_changed = (
+        merged['rating_count_old'].astype('Int64').fillna(-1) != merged['rating_count_new'].astype('Int64').fillna(-1)
+    )
+    status = pd.Series(pd.NA, index=merged.index, dtype='string')
+    status = status.mask(rating_changed, 'rating_changed').mask(price_changed, 'price_changed')
+    status = status.mask(merged['_merge'] == 'right_only', 'added').mask(merged['_merge'] == 'left_only', 'removed')
+
+    changes = pd.DataFrame({
+        'key': merged['key'],
+        'brand': merged['brand_new'].fillna(merged['brand_old']),
+        'product_name': merged['product_name_new'].fillna(merged['product_name_old']),
+        'status': status,
+        'old_price': merged['price_old'].astype('float64'),
+        'new_price': merged['price_new'].astype('float64'),
+        'old_rating_count': merged['rating_count_old'].astype('Int64'),
+        'new_rating_count': merged['rating_count_new'].astype('Int64'),
+    })
+    changes['price_change'] = changes['new_price'] - changes['old_price']
+    return changes[changes['status'].notna()].reset_index(drop=True)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='Store scraped product listings and show what changed.')
+    parser.add_argument('directory', help='store directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help='store scraper output files as snapshots')
+    add.add_argument('files', nargs='+')
+    changes = commands.add_parser('changes', help='show changes since the previous snapshot')
+    changes.add_argument('--since', type=datetime.datetime.fromisoformat)
+    args = parser.parse_args(argv)
+
+    store = ListingsStore(args.directory)
+    if args.command == 'add':
+        print(f'Imported {store.import_files(args.files)} files')
+    else:
+        with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200):
+            print(store.changes(since=args.since))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
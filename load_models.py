@@ -1,17 +1,176 @@
-from pydantic_ai.models.groq import GroqModel
-from pydantic_ai.models.openai import OpenAIChatModel
-from pydantic_ai.models.gemini import GeminiModel
-from dotenv import load_dotenv
-load_dotenv()
+"""Lazy model registry.
+
+Provider SDKs are only imported when a model from that provider is first
+requested, and each model is built once per process.
+
+    from load_models import get_model
+    model = get_model('gemini')
+
+The old module constants (``GROQ_MODEL``, ``OPENAI_MODEL``, ``GEMINI_MODEL``)
+still work and resolve through the registry on first access.
+
+Set MODEL_CACHE_MODE to ``record`` or ``replay`` to route every model through
+the response cache in ``model_cache`` (stored at MODEL_CACHE_PATH). Every
+model is also timed and metered by ``instrumentation`` unless AGENT_METRICS
+is ``off``.
+
+Set MODEL_ROUTING to ``hedged`` and ``get_model`` returns a ``HedgedModel``
+that prefers the requested provider but routes to, and hedges against, the
+other registered providers that have an API key set, by observed latency and
+error rate.
+``get_routed_model`` builds such a router explicitly.
+
+``await warm_up(model)`` opens the HTTPS connections a model will use, so the
+first request of a long-lived session doesn't pay for DNS and TLS.
+"""
+from __future__ import annotations
+
+import os
+import importlib
+from dataclasses import dataclass
+from functools import cache
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from pydantic_ai.models import Model
+
 # GROQ_MODEL = 'llama-3.1-8b-instant'
 # OPENAI_MODEL = 'openai:gpt-5 nano'
 ## OLLAMA_MODEL = 'ollama:llama3:8b'
 # GEMINI_MODEL = 'gemini-2.5-flash'
 
 
-GROQ_MODEL = GroqModel('llama-3.1-8b-instant')
-OPENAI_MODEL = OpenAIChatModel("gpt-5-nano")
-# OLLAMA_MODEL(
-GEMINI_MODEL = GeminiModel('gemini-2.5-flash')
+@dataclass(frozen=True)
+class ModelSpec:
+    module: str
+    class_name: str
+    model_name: str
+    api_key_env: str
+
+
+MODEL_SPECS: dict[str, ModelSpec] = {
+    'groq': ModelSpec('pydantic_ai.models.groq', 'GroqModel', 'llama-3.1-8b-instant', 'GROQ_API_KEY'),
+    'openai': ModelSpec('pydantic_ai.models.openai', 'OpenAIChatModel', 'gpt-5-nano', 'OPENAI_API_KEY'),
+    # 'ollama': ...
+    'gemini': ModelSpec('pydantic_ai.models.gemini', 'GeminiModel', 'gemini-2.5-flash', 'GEMINI_API_KEY'),
+}
+
+# Backwards compatible module attributes -> registry names
+_LEGACY_NAMES = {
+    'GROQ_MODEL': 'groq',
+    'OPENAI_MODEL': 'openai',
+    'GEMINI_MODEL': 'gemini',
+}
+
+
+@cache
+def _load_env() -> None:
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+@cache
+def _response_store():
+    from model_cache import ResponseStore
+    return ResponseStore(os.getenv('MODEL_CACHE_PATH', '.model_cache.sqlite'))
+
+
+def _configured(name: str) -> bool:
+    _load_env()
+    return bool(os.getenv(MODEL_SPECS[name].api_key_env))
+
+
+@cache
+def _build_model(name: str) -> Model:
+    try:
+        spec = MODEL_SPECS[name]
+    except KeyError:
+        raise KeyError(f'Unknown model {name!r}, expected one of {sorted(MODEL_SPECS)}') from None
+    _load_env()
+    model_cls = getattr(importlib.import_module(spec.module), spec.class_name)
+    model = model_cls(spec.model_name)
+
+    mode = os.getenv('MODEL_CACHE_MODE', 'passthrough')
+    if mode != 'passthrough':
+        from model_cache import CachingModel
+        model = CachingModel(model, _response_store(), mode)
+
+    if os.getenv('AGENT_METRICS', 'on') != 'off':
+        from instrumentation import InstrumentedModel
+        model = InstrumentedModel(model)
+    return model
+
+
+@cache
+def get_routed_model(*names: str) -> Model:
+    """
+    Returns a hedged router over the named models, the first one preferred
+    until the observed latencies say otherwise.
+
+    Args:
+        names: Registry names, defaults to every model in MODEL_SPECS whose
+            API key is set
+
+    Returns:
+        The memoized HedgedModel
+    """
+    from hedged_model import HedgedModel
+    names = names or tuple(name for name in MODEL_SPECS if _configured(name))
+    return HedgedModel(*(_build_model(name) for name in names))
+
+
+@cache
+def get_model(name: str) -> Model:
+    """
+    Returns the model registered under `name`, building it on first use.
+
+    Args:
+        name: Registry name, one of MODEL_SPECS
+
+    Returns:
+        The memoized model instance
+    """
+    if os.getenv('MODEL_ROUTING', 'single') == 'hedged':
+        _build_model(name)  # fail fast on unknown names and a missing key
+        # Providers without a key can't be built, let alone hedged to
+        others = (other for other in MODEL_SPECS if other != name and _configured(other))
+        return get_routed_model(name, *others)
+    return _build_model(name)
+
+
+def _endpoints(model: Model) -> set[tuple[str, str]]:
+    # Routers hold several models, wrappers (cache, instrumentation) hold one
+    if hasattr(model, 'models'):
+        return set().union(*(_endpoints(m) for m in model.models))
+    if hasattr(model, 'wrapped'):
+        return _endpoints(model.wrapped)
+    return {(model.system, model.base_url)} if model.base_url else set()
+
+
+async def warm_up(model: Model) -> None:
+    """
+    Connects to each provider behind `model` through the HTTP client its
+    provider uses, pydantic_ai's cached client for that provider name,
+    leaving the connections in that client's pool. The pool belongs to the
+    running event loop, so call this from the loop that will make the
+    requests. Providers built with their own http_client aren't warmed.
+    """
+    import asyncio
+    import httpx
+    from pydantic_ai.models import cached_async_http_client
+
+    async def connect(system: str, url: str) -> None:
+        client = cached_async_http_client(provider=system)
+        try:
+            # Any response at all means the connection is up
+            await client.head(url, timeout=5)
+        except httpx.HTTPError as e:
+            print(f'Could not warm up {url}: {e}')
+
+    await asyncio.gather(*(connect(system, url) for system, url in _endpoints(model)))
 
 
+def __getattr__(attr: str) -> Model:
+    if attr in _LEGACY_NAMES:
+        return get_model(_LEGACY_NAMES[attr])
+    raise AttributeError(f'module {__name__!r} has no attribute {attr!r}')
@@ -0,0 +1,280 @@
+"""
+End-to-end load test against the local stand-in provider.
+
+Unlike benchmark.py, which swaps the model for an in-process FunctionModel,
+this goes through the real stack: OpenAIChatModel, the OpenAI SDK, httpx and
+pydantic_ai's shared connection pool talk HTTP to `standin_server.py`. The
+scraper also fetches its page over HTTP from the same server. Each scenario
+runs closed-loop at every concurrency level given, and the report shows
+throughput, latency percentiles and the client's CPU and memory, which is
+where saturation shows up.
+
+    python load_test.py --concurrency 1 8 32 --duration 20
+    python load_test.py weather --latency 0.5 --error-rate 0.05
+    python load_test.py --server http://127.0.0.1:8765   # already running
+
+No provider is called, placeholder API keys are set so clients can be built.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+from contextlib import ExitStack, redirect_stdout
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Awaitable, Callable
+
+for key in ('GEMINI_API_KEY', 'GOOGLE_API_KEY', 'OPENAI_API_KEY', 'GROQ_API_KEY'):
+    os.environ.setdefault(key, 'load-test')
+# Keep the scraper's page cache out of the working tree, and revalidate every
+# fetch so the page really goes over HTTP on each run instead of being served
+# from disk after the warm-up (the stand-in sends no validators, so every
+# revalidation is a full 200)
+os.environ.setdefault('FETCH_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'load_test_fetch_cache'))
+os.environ.setdefault('FETCH_CACHE_MODE', 'refresh')
+# Parse on a thread in this process, CPU used by a pool of worker processes
+# wouldn't show up in cpu_cores
+os.environ.setdefault('HTML_PARSE_WORKERS', '0')
+
+from pydantic_ai.models import Model
+from pydantic_ai.models.openai import OpenAIChatModel
+from pydantic_ai.providers.openai import OpenAIProvider
+
+from instrumentation import InstrumentedModel, metrics, percentile
+
+
+def standin_model(base_url: str) -> Model:
+    """The openai registry model, pointed at the stand-in and instrumented like get_model's."""
+    model = OpenAIChatModel('gpt-5-nano', provider=OpenAIProvider(base_url=f'{base_url}/v1', api_key='standin'))
+    return InstrumentedModel(model)
+
+
+# ---------------------------------------------------------------------------
+# Scenarios, each returns a coroutine factory for one complete run
+
+Scenario = Callable[[Model, str], Callable[[], Awaitable[object]]]
+
+
+def weather(model: Model, base_url: str) -> Callable[[], Awaitable[object]]:
+    from weather_agents import Deps, weather_agent
+
+    deps = Deps(weather_api_key='load-test', geo_api_key='load-test')
+
+    async def run():
+        with weather_agent.override(model=model):
+            return await weather_agent.run('What is the weather like in London and in San Francisco, CA?', deps=deps)
+    return run
+
+
+def web_scraping(model: Model, base_url: str) -> Callable[[], Awaitable[object]]:
+    from web_scrapping_agent import web_scraping_agent
+
+    async def run():
+        with web_scraping_agent.override(model=model):
+            return await web_scraping_agent.run(f'{base_url}/listing?q=laptop')
+    return run
+
+
+def feedback_graph(model: Model, base_url: str) -> Callable[[], Awaitable[object]]:
+    from email_feedback import FeedbackDeps, State, User, WriteEmail, email_writer_agent, feedback_agent, feedback_graph
+
+    user = User(name='Jay', email='jay@example.com', interests=['AI Agent', 'Photography'])
+
+    async def run():
+        with ExitStack() as stack:
+            stack.enter_context(email_writer_agent.override(model=model))
+            stack.enter_context(feedback_agent.override(model=model))
+            return await feedback_graph.run(WriteEmail(), state=State(user), deps=FeedbackDeps())
+    return run
+
+
+SCENARIOS: dict[str, Scenario] = {
+    'weather': weather,
+    'web_scraping': web_scraping,
+    'feedback_graph': feedback_graph,
+}
+
+
+# ---------------------------------------------------------------------------
+# Load generator
+
+@dataclass
+class LoadResult:
+    scenario: str
+    concurrency: int
+    runs: int
+    errors: int
+    seconds: float
+    runs_per_second: float
+    model_requests_per_second: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    max_ms: float
+    cpu_cores: float
+    rss_mb: float
+    peak_rss_mb: float
+
+
+def _rss_mb() -> float:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        return 0.0
+
+
+async def drive(run: Callable[[], Awaitable[object]], concurrency: int, duration: float) -> tuple[list[float], int]:
+    """
+    Keeps `concurrency` runs in flight for `duration` seconds, each worker
+    starting its next run when the previous one ends.
+
+    Returns:
+        Latencies of the successful runs and the number of failed ones
+    """
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                await run()
+            except Exception:  # noqa: BLE001 - failures are counted, not fatal
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors
+
+
+async def measure(name: str, run: Callable[[], Awaitable[object]], concurrency: int, duration: float) -> LoadResult:
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        warm_up_errors = 0
+        try:
+            await run()  # warm up imports, connections and caches
+        except Exception:  # noqa: BLE001 - counted like any other failed run
+            warm_up_errors = 1
+        requests = metrics.total('agent_model_requests_total')
+        cpu, start = time.process_time(), time.perf_counter()
+        latencies, errors = await drive(run, concurrency, duration)
+        seconds = time.perf_counter() - start
+        cpu = time.process_time() - cpu
+        requests = metrics.total('agent_model_requests_total') - requests
+        errors += warm_up_errors
+
+    return LoadResult(
+        scenario=name,
+        concurrency=concurrency,
+        runs=len(latencies),
+        errors=errors,
+        seconds=seconds,
+        runs_per_second=len(latencies) / seconds,
+        model_requests_per_second=requests / seconds,
+        p50_ms=(percentile(latencies, 0.50) or 0.0) * 1000,
+        p90_ms=(percentile(latencies, 0.90) or 0.0) * 1000,
+        p99_ms=(percentile(latencies, 0.99) or 0.0) * 1000,
+        max_ms=max(latencies, default=0) * 1000,
+        cpu_cores=cpu / seconds,
+        rss_mb=_rss_mb(),
+        # ru_maxrss is in KB on Linux
+        peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Stand-in server process
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(latency: float, latency_sigma: float, error_rate: float) -> tuple[subprocess.Popen, str]:
+    """Starts standin_server.py in its own process so its CPU isn't counted as ours."""
+    port = _free_port()
+    process = subprocess.Popen([
+        sys.executable, str(Path(__file__).with_name('standin_server.py')),
+        '--port', str(port),
+        '--latency', str(latency),
+        '--latency-sigma', str(latency_sigma),
+        '--error-rate', str(error_rate),
+    ])
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError('Stand-in server did not start')
+
+
+async def amain(args: argparse.Namespace, base_url: str) -> list[LoadResult]:
+    model = standin_model(base_url)
+    results = []
+    for name in args.scenarios or SCENARIOS:
+        run = SCENARIOS[name](model, base_url)
+        for concurrency in args.concurrency:
+            result = await measure(name, run, concurrency, args.duration)
+            results.append(result)
+            print(
+                f'{name:15} c={concurrency:<4} {result.runs_per_second:8.1f} runs/s '
+                f'{result.model_requests_per_second:8.1f} req/s  '
+                f'p50 {result.p50_ms:8.1f}  p90 {result.p90_ms:8.1f}  p99 {result.p99_ms:8.1f} ms  '
+                f'errors {result.errors:<4} cpu {result.cpu_cores:4.2f} cores  rss {result.rss_mb:7.1f} MB',
+                flush=True,
+            )
+    return results
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='Load test the agents against a local stand-in provider.')
+    parser.add_argument('scenarios', nargs='*', help=f"any of {', '.join(SCENARIOS)}, all by default")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--duration', type=float, default=10, help='seconds per concurrency level')
+    parser.add_argument('--server', help='use this running stand-in server instead of starting one')
+    parser.add_argument('--latency', type=float, default=0.2, help='median seconds per completion')
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    parser.add_argument('--metrics', help='write the client-side metrics here in the Prometheus text format')
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    process = None
+    if args.server:
+        base_url = args.server.rstrip('/').removesuffix('/v1')
+    else:
+        process, base_url = start_server(args.latency, args.latency_sigma, args.error_rate)
+    try:
+        results = asyncio.run(amain(args, base_url))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    if args.output:
+        Path(args.output).write_text(json.dumps([asdict(r) for r in results], indent=2), encoding='utf-8')
+        print(f'Saved {args.output}')
+    if args.metrics:
+        metrics.write_prometheus(args.metrics)
+        print(f'Saved {args.metrics}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,76 @@
+"""
+Bounded message history for agents that are re-run in a loop.
+
+Each run's new messages are merged into the stored history without repeating
+any that are already there, and before a run the history is compacted to a
+token budget: the first round (it carries the system prompt) and as many of
+the most recent rounds as fit are kept, older rounds are dropped. What those
+rounds said can be summarised in the prompt instead, see `summarize_feedback`.
+
+A round is a user prompt and everything the model and tools said after it.
+"""
+from pydantic_ai.messages import ModelMessage, ModelMessagesTypeAdapter, ModelRequest, UserPromptPart
+
+CHARS_PER_TOKEN = 4
+
+
+def _key(message: ModelMessage) -> str:
+    return ModelMessagesTypeAdapter.dump_json([message]).decode()
+
+
+def merge_messages(history: list[ModelMessage], new: list[ModelMessage]) -> list[ModelMessage]:
+    """Appends the messages of `new` that aren't already in `history`."""
+    seen = {_key(m) for m in history}
+    merged = list(history)
+    for message in new:
+        key = _key(message)
+        if key not in seen:
+            seen.add(key)
+            merged.append(message)
+    return merged
+
+
+def split_rounds(messages: list[ModelMessage]) -> list[list[ModelMessage]]:
+    rounds: list[list[ModelMessage]] = []
+    for message in messages:
+        starts_round = isinstance(message, ModelRequest) and any(
+            isinstance(part, UserPromptPart) for part in message.parts
+        )
+        if starts_round or not rounds:
+            rounds.append([])
+        rounds[-1].append(message)
+    return rounds
+
+
+def estimate_tokens(messages: list[ModelMessage]) -> int:
+    return len(ModelMessagesTypeAdapter.dump_json(messages)) // CHARS_PER_TOKEN + 1
+
+
+def compact_history(messages: list[ModelMessage], max_tokens: int) -> list[ModelMessage]:
+    """
+    Trims `messages` to roughly `max_tokens`.
+
+    Returns:
+        The first round followed by the most recent rounds that fit the
+        budget. The latest round is always kept, even when it alone is over.
+    """
+    rounds = split_rounds(messages)
+    if len(rounds) <= 2 or estimate_tokens(messages) <= max_tokens:
+        return messages
+
+    first, rest = rounds[0], rounds[1:]
+    budget = max_tokens - estimate_tokens(first)
+    kept: list[list[ModelMessage]] = []
+    for round_ in reversed(rest):
+        tokens = estimate_tokens(round_)
+        if kept and tokens > budget:
+            break
+        kept.insert(0, round_)
+        budget -= tokens
+    return [m for round_ in [first, *kept] for m in round_]
+
+
+def summarize_feedback(feedback: list[str], max_items: int = 5) -> str:
+    """One line per earlier piece of feedback, oldest dropped past `max_items`."""
+    return '\n'.join('- ' + ' '.join(item.split()) for item in feedback[-max_items:])
+
@@ -0,0 +1,239 @@
+"""
+Record/replay cache for model requests.
+
+`CachingModel` wraps any pydantic_ai model. Each request is keyed by a hash of
+the model name, the messages (minus timestamps, ids and usage, which differ
+between otherwise identical runs), the tool and output definitions and the
+model settings, and the response is kept in a SQLite store that evicts the
+least recently used entries past `max_entries`.
+
+Modes:
+    record       serve hits from the store, call the model and store on a miss
+    replay       only serve from the store, a miss raises ModelCacheMiss
+    passthrough  always call the model, the store is not touched
+
+`load_models.get_model` wraps every model when MODEL_CACHE_MODE is record or
+replay, with the store at MODEL_CACHE_PATH. Replay never calls the provider,
+but provider clients still want an API key to be constructed, any placeholder
+value will do.
+"""
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import dataclasses
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from pydantic_core import to_jsonable_python
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelMessagesTypeAdapter,
+    ModelResponse,
+    ModelResponseStreamEvent,
+    TextPart,
+    ThinkingPart,
+    ToolCallPart,
+)
+from pydantic_ai.models import Model, ModelRequestParameters, StreamedResponse
+from pydantic_ai.models.wrapper import WrapperModel
+from pydantic_ai.settings import ModelSettings
+
+MODES = ('record', 'replay', 'passthrough')
+# Fields that change between runs without changing what was asked
+VOLATILE_KEYS = {'timestamp', 'tool_call_id', 'provider_response_id', 'provider_details', 'usage', 'id'}
+
+
+# Set in provider_details of every response served from the store, which is
+# one of the volatile keys so it never changes a request key
+CACHE_HIT = 'model_cache_hit'
+
+
+class ModelCacheMiss(Exception):
+    pass
+
+
+def is_cache_hit(response: ModelResponse) -> bool:
+    """Whether `response` was replayed from a ResponseStore instead of the provider."""
+    return bool((response.provider_details or {}).get(CACHE_HIT))
+
+
+def _mark_hit(response: ModelResponse) -> ModelResponse:
+    return dataclasses.replace(response, provider_details={**(response.provider_details or {}), CACHE_HIT: True})
+
+
+def _strip_volatile(messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    # Only message and part fields, tool arguments and returns are kept as they are
+    def strip(item: dict[str, Any]) -> dict[str, Any]:
+        return {k: v for k, v in item.items() if k not in VOLATILE_KEYS}
+
+    return [{**strip(m), 'parts': [strip(p) for p in m.get('parts', [])]} for m in messages]
+
+
+def request_key(
+    model_name: str,
+    messages: list[ModelMessage],
+    model_settings: ModelSettings | None,
+    model_request_parameters: ModelRequestParameters,
+) -> str:
+    payload = {
+        'model': model_name,
+        'messages': _strip_volatile(ModelMessagesTypeAdapter.dump_python(messages, mode='json')),
+        'settings': to_jsonable_python(model_settings or {}, fallback=repr),
+        'parameters': to_jsonable_python(model_request_parameters, fallback=repr),
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class ResponseStore:
+    def __init__(self, path: str | Path = '.model_cache.sqlite', max_entries: int = 10_000):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, model TEXT, response BLOB, created REAL, last_used REAL)'
+        )
+        self._db.commit()
+
+    def get(self, key: str) -> ModelResponse | None:
+        with self._lock:
+            row = self._db.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute('UPDATE responses SET last_used = ? WHERE key = ?', (time.time(), key))
+            self._db.commit()
+            self.hits += 1
+        return ModelMessagesTypeAdapter.validate_json(row[0])[0]
+
+    def put(self, key: str, model_name: str, response: ModelResponse) -> None:
+        blob = ModelMessagesTypeAdapter.dump_json([response])
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses (key, model, response, created, last_used) VALUES (?, ?, ?, ?, ?)',
+                (key, model_name, blob, now, now),
+            )
+            self._db.execute(
+                'DELETE FROM responses WHERE key IN ('
+                'SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,),
+            )
+            self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+
+@dataclass
+class ReplayStreamedResponse(StreamedResponse):
+    """Streams a stored response back, one event per part."""
+
+    _response: ModelResponse = field(kw_only=True)
+
+    async def _get_event_iterator(self) -> AsyncIterator[ModelResponseStreamEvent]:
+        self._usage = self._response.usage
+        for index, part in enumerate(self._response.parts):
+            if isinstance(part, TextPart):
+                event = self._parts_manager.handle_text_delta(vendor_part_id=index, content=part.content)
+                if event is not None:
+                    yield event
+            elif isinstance(part, ToolCallPart):
+                yield self._parts_manager.handle_tool_call_part(
+                    vendor_part_id=index,
+                    tool_name=part.tool_name,
+                    args=part.args,
+                    tool_call_id=part.tool_call_id,
+                )
+            elif isinstance(part, ThinkingPart):
+                yield self._parts_manager.handle_thinking_delta(vendor_part_id=index, content=part.content)
+
+    def get(self) -> ModelResponse:
+        return _mark_hit(super().get())
+
+    @property
+    def model_name(self) -> str:
+        return self._response.model_name or ''
+
+    @property
+    def provider_name(self) -> str | None:
+        return self._response.provider_name
+
+    @property
+    def timestamp(self) -> datetime:
+        return self._response.timestamp
+
+
+class CachingModel(WrapperModel):
+    def __init__(self, wrapped: Model, store: ResponseStore, mode: str = 'record'):
+        if mode not in MODES:
+            raise ValueError(f'Unknown model cache mode {mode!r}, expected one of {MODES}')
+        super().__init__(wrapped)
+        self.store = store
+        self.mode = mode
+
+    def _key(self, messages, model_settings, model_request_parameters) -> str:
+        return request_key(
+            f'{self.wrapped.system}:{self.wrapped.model_name}',
+            messages,
+            model_settings,
+            model_request_parameters,
+        )
+
+    def _lookup(self, key: str) -> ModelResponse | None:
+        if self.mode == 'passthrough':
+            return None
+        response = self.store.get(key)
+        if response is None and self.mode == 'replay':
+            raise ModelCacheMiss(f'No recorded response for {self.model_name} request {key[:12]}')
+        return response
+
+    async def request(
+        self,
+        messages: list[ModelMessage],
+        model_settings: ModelSettings | None,
+        model_request_parameters: ModelRequestParameters,
+    ) -> ModelResponse:
+        key = self._key(messages, model_settings, model_request_parameters)
+        if (response := self._lookup(key)) is not None:
+            return _mark_hit(response)
+        response = await self.wrapped.request(messages, model_settings, model_request_parameters)
+        if self.mode == 'record':
+            self.store.put(key, self.model_name, response)
+        return response
+
+    @asynccontextmanager
+    async def request_stream(
+        self,
+        messages: list[ModelMessage],
+        model_settings: ModelSettings | None,
+        model_request_parameters: ModelRequestParameters,
+        run_context=None,
+    ) -> AsyncIterator[StreamedResponse]:
+        key = self._key(messages, model_settings, model_request_parameters)
+        if (response := self._lookup(key)) is not None:
+            yield ReplayStreamedResponse(model_request_parameters, _response=response)
+            return
+
+        async with self.wrapped.request_stream(
+            messages, model_settings, model_request_parameters, run_context
+        ) as stream:
+            yield stream
+        # A stream the caller stopped reading early still has parts but would
+        # replay as a truncated answer, so only keep responses the provider
+        # finished. pydantic_ai versions without finish_reason never record
+        # streams.
+        response = stream.get()
+        if self.mode == 'record' and response.parts and getattr(response, 'finish_reason', None):
+            self.store.put(key, self.model_name, response)
@@ -0,0 +1,171 @@
+"""
+Deterministic product-card pre-extraction for listing pages.
+
+Search result pages repeat the same card markup once per product. Finding that
+repeated structure lets us hand the agent a few compact lines per product
+instead of the whole page text (filters, nav, promos), and for sites with known
+markup we can skip the model entirely.
+"""
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+from bs4 import BeautifulSoup, Tag
+
+# '₹1,23,999', 'AED 21,219', '$1,299.00', or a bare grouped number like '21,219'
+PRICE_RE = re.compile(
+    r'(?:₹|\$|€|£|AED|Rs\.?|INR)\s?\d[\d,]*(?:\.\d{1,2})?'
+    r'|\b\d{1,3}(?:,\d{2,3})+(?:\.\d{1,2})?\b'
+)
+RATING_RE = re.compile(
+    r'\b[0-5]\.\d\b'
+    r'|\(?\d[\d,]*\)?\s*(?:ratings?|reviews?)'
+    r'|\(\d[\d,]*\)',
+    re.IGNORECASE,
+)
+COUNT_RE = re.compile(r'(\d[\d,]*)\s*(?:ratings?|reviews?)|\((\d[\d,]*)\)', re.IGNORECASE)
+
+MIN_REPEATS = 3
+MIN_PRICED_SHARE = 0.6
+
+
+@dataclass
+class Candidate:
+    title: str
+    price: str | None = None
+    rating: str | None = None
+    brand: str | None = None
+
+    def to_line(self) -> str:
+        return ' | '.join([self.title, self.price or '-', self.rating or '-'])
+
+
+# Site specific selectors. When a host is listed here and its selectors match,
+# products are filled in directly without calling the model.
+SITE_RULES: dict[str, dict[str, str]] = {
+    'www.noon.com': {
+        'card': '[data-qa="plp-product-box"], div[class*="ProductBoxLinkHandler"]',
+        'title': '[data-qa="plp-product-box-name"], [data-qa="product-name"]',
+        'price': 'strong.amount, [data-qa="plp-product-box-price"]',
+        'rating': '[class*="RatingCount"], [class*="ratingCount"]',
+    },
+    'www.flipkart.com': {
+        'card': 'div[data-id]',
+        'title': 'div.KzDlHZ, a.wjcEIp, a.WKTcLC',
+        'price': 'div.Nx9bqj',
+        'rating': 'span.Wphh3N',
+    },
+}
+
+
+def _signature(tag: Tag) -> tuple[str, tuple[str, ...]]:
+    return tag.name, tuple(sorted(tag.get('class') or ()))
+
+
+def _texts(tag: Tag) -> list[str]:
+    return [s for s in tag.stripped_strings if s]
+
+
+def _card_from_tag(tag: Tag) -> Candidate | None:
+    texts = _texts(tag)
+    if not texts:
+        return None
+
+    price = next((m.group(0) for t in texts if (m := PRICE_RE.search(t))), None)
+    rating = next((t for t in texts if RATING_RE.search(t) and not PRICE_RE.fullmatch(t)), None)
+
+    title = None
+    for attr_tag in tag.find_all(['a', 'img', 'h1', 'h2', 'h3', 'h4'], limit=10):
+        value = attr_tag.get('title') or attr_tag.get('alt')
+        if value and len(value) > 10:
+            title = value.strip()
+            break
+    if title is None:
+        heading = tag.find(['h1', 'h2', 'h3', 'h4'])
+        if heading and heading.get_text(strip=True):
+            title = heading.get_text(' ', strip=True)
+    if title is None:
+        # The longest piece of text that isn't a price, rating or badge
+        words = [t for t in texts if not PRICE_RE.search(t) and not RATING_RE.search(t)]
+        title = max(words, key=len, default=None)
+    if not title:
+        return None
+    return Candidate(title=title, price=price, rating=rating)
+
+
+def find_card_group(soup: BeautifulSoup) -> list[Tag]:
+    """
+    Finds the largest group of same-shaped siblings that mostly contain a price.
+
+    Returns:
+        The card elements, in document order, or an empty list
+    """
+    best: list[Tag] = []
+    for parent in soup.find_all(True):
+        groups: dict[tuple, list[Tag]] = defaultdict(list)
+        for child in parent.find_all(True, recursive=False):
+            groups[_signature(child)].append(child)
+        for members in groups.values():
+            if len(members) < MIN_REPEATS or len(members) <= len(best):
+                continue
+            priced = sum(1 for m in members if PRICE_RE.search(m.get_text(' ')))
+            if priced / len(members) >= MIN_PRICED_SHARE:
+                best = members
+    return best
+
+
+def extract_candidates(soup: BeautifulSoup) -> list[Candidate]:
+    """
+    Returns compact candidate records for every product card found in the page.
+    """
+    candidates = []
+    for card in find_card_group(soup):
+        candidate = _card_from_tag(card)
+        if candidate:
+            candidates.append(candidate)
+    return candidates
+
+
+def extract_known_site(url: str, soup: BeautifulSoup) -> list[Candidate]:
+    """
+    Applies SITE_RULES for the URL's host.
+
+    Returns:
+        Fully populated candidates, or an empty list if the site is unknown or
+        its markup no longer matches the rules
+    """
+    rules = SITE_RULES.get(urlsplit(url).netloc.lower())
+    if not rules:
+        return []
+
+    candidates = []
+    for card in soup.select(rules['card']):
+        title = card.select_one(rules['title'])
+        if title is None or not title.get_text(strip=True):
+            continue
+        price = card.select_one(rules['price'])
+        rating = card.select_one(rules['rating'])
+        name = title.get('title') or title.get_text(' ', strip=True)
+        candidates.append(Candidate(
+            title=name,
+            price=price.get_text(strip=True) if price else None,
+            rating=rating.get_text(strip=True) if rating else None,
+            brand=name.split()[0],
+        ))
+    return candidates
+
+
+def parse_rating_count(rating: str | None) -> int | None:
+    """'1,234 Ratings' -> 1234, '(87)' -> 87, anything else -> None"""
+    if not rating:
+        return None
+    match = COUNT_RE.search(rating)
+    if not match:
+        return None
+    return int((match.group(1) or match.group(2)).replace(',', ''))
+
+
+def format_candidates(candidates: list[Candidate]) -> str:
+    header = 'title | price | rating'
+    return '\n'.join([header] + [c.to_line() for c in candidates])
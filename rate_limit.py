@@ -0,0 +1,42 @@
+"""
+Token-bucket rate limiter usable from both threads and coroutines.
+
+A bucket refills at `rate` tokens per second up to `capacity`. Callers reserve
+a token up front and then sleep for however long the reservation says, so
+waiting callers are served in arrival order without busy looping.
+"""
+import time
+import asyncio
+import threading
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float | None = None):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: float = 1) -> float:
+        """Takes `tokens` from the bucket and returns how long to wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, tokens: float = 1) -> None:
+        delay = self._reserve(tokens)
+        if delay:
+            time.sleep(delay)
+
+    async def wait(self, tokens: float = 1) -> None:
+        delay = self._reserve(tokens)
+        if delay:
+            await asyncio.sleep(delay)
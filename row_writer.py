@@ -0,0 +1,155 @@
+"""
+Incremental row writers for extracted products.
+
+Rows are appended and flushed one at a time, so a consumer tailing the file
+sees each product as soon as it is written and nothing is held in memory.
+The format follows the file suffix (.csv or .jsonl). Passing `parquet_path`
+also converts the finished file to Parquet on close, in batches, with the
+column types given in `dtypes`.
+
+    with open_writer('products.jsonl', parquet_path='products.parquet', dtypes=PRODUCT_DTYPES) as writer:
+        writer.write(product)
+"""
+import csv
+import json
+import importlib.util
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Iterator
+
+import pandas as pd
+from pydantic import BaseModel
+
+PARQUET_BATCH_ROWS = 10_000
+
+
+class RowWriter(ABC):
+    suffix = ''
+
+    def __init__(
+        self,
+        path: str | Path,
+        parquet_path: str | Path | None = None,
+        dtypes: dict[str, str] | None = None,
+    ):
+        if parquet_path is not None and importlib.util.find_spec('pyarrow') is None:
+            # Fail before the run instead of after all the model time is spent
+            raise ImportError('Writing Parquet requires pyarrow, install it with `pip install pyarrow`')
+        self.path = Path(path)
+        self.parquet_path = Path(parquet_path) if parquet_path is not None else None
+        self.dtypes = dtypes
+        self.rows = 0
+        self._file = self.path.open('w', encoding='utf-8', newline='')
+
+    @abstractmethod
+    def _write_row(self, row: dict) -> None:
+        ...
+
+    @abstractmethod
+    def _read_batches(self) -> Iterator[pd.DataFrame]:
+        ...
+
+    def write(self, row: BaseModel | dict) -> None:
+        if isinstance(row, BaseModel):
+            row = row.model_dump()
+        self._write_row(row)
+        self._file.flush()
+        self.rows += 1
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self._file.close()
+        if self.parquet_path is not None and self.rows:
+            self._write_parquet()
+
+    def _write_parquet(self) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = None
+        if self.dtypes is not None:
+            # Fixed up front, a column that happens to be all empty in the
+            # first batch would otherwise be typed null and fail later ones
+            empty = pd.DataFrame({name: pd.Series(dtype=dtype) for name, dtype in self.dtypes.items()})
+            schema = pa.Schema.from_pandas(empty, preserve_index=False)
+        parquet = None
+        try:
+            for batch in self._read_batches():
+                table = pa.Table.from_pandas(batch, schema=schema, preserve_index=False)
+                if parquet is None:
+                    parquet = pq.ParquetWriter(self.parquet_path, table.schema)
+                parquet.write_table(table.cast(parquet.schema))
+        finally:
+            if parquet is not None:
+                parquet.close()
+
+    def __enter__(self) -> 'RowWriter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class CsvRowWriter(RowWriter):
+    suffix = '.csv'
+
+    def __init__(
+        self,
+        path: str | Path,
+        parquet_path: str | Path | None = None,
+        dtypes: dict[str, str] | None = None,
+    ):
+        super().__init__(path, parquet_path, dtypes)
+        self._writer: csv.DictWriter | None = None
+
+    def _write_row(self, row: dict) -> None:
+        if self._writer is None:
+            # The first row fixes the columns, like DataFrame.to_csv did
+            self._writer = csv.DictWriter(self._file, fieldnames=list(row))
+            self._writer.writeheader()
+        self._writer.writerow(row)
+
+    def _read_batches(self):
+        # Keep missing values as missing and counts as nullable integers
+        return pd.read_csv(self.path, chunksize=PARQUET_BATCH_ROWS, dtype=self.dtypes, dtype_backend='numpy_nullable')
+
+
+class JsonlRowWriter(RowWriter):
+    suffix = '.jsonl'
+
+    def _write_row(self, row: dict) -> None:
+        self._file.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+    def _read_batches(self):
+        return pd.read_json(
+            self.path, lines=True, chunksize=PARQUET_BATCH_ROWS, dtype=self.dtypes, dtype_backend='numpy_nullable'
+        )
+
+
+WRITERS: dict[str, type[RowWriter]] = {cls.suffix: cls for cls in (CsvRowWriter, JsonlRowWriter)}
+
+
+def open_writer(
+    path: str | Path,
+    parquet_path: str | Path | None = None,
+    dtypes: dict[str, str] | None = None,
+) -> RowWriter:
+    """
+    Opens the writer matching `path`'s suffix.
+
+    Args:
+        path: Output file, ending in .csv or .jsonl
+        parquet_path: If given, the finished file is also written here as Parquet
+        dtypes: pandas dtype per column, fixes the Parquet schema instead of
+            inferring it from the first batch
+
+    Returns:
+        An open RowWriter, close it (or use it as a context manager) to finish the file
+    """
+    suffix = Path(path).suffix.lower()
+    try:
+        writer_cls = WRITERS[suffix]
+    except KeyError:
+        raise ValueError(f'Unsupported output format {suffix!r}, expected one of {sorted(WRITERS)}') from None
+    return writer_cls(path, parquet_path, dtypes)
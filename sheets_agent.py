@@ -1,19 +1,98 @@
+import os
 import ssl
+import asyncio
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from pydantic_ai import Agent, RunContext
 from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Callable
+from dataclasses import dataclass, field
 from googleapiclient.discovery import Resource
+from pydantic_ai.messages import ModelMessage
 from pydantic_ai.settings import ModelSettings
 from pydantic_ai.exceptions import ModelRetry, UnexpectedModelBehavior
-from google_apis import create_service
-from load_models import GEMINI_MODEL
+from google_apis import create_service, create_service_pool, ServicePool
+from load_models import get_model, warm_up
+from message_history import compact_history
+from instrumentation import instrumented_tool
+from sheets_cache import SheetMetadataCache
+from sheets_batch import BatchUpdateQueue
+from sheets_quota import SheetsQuota
+from sheets_sync import sync_csv
 
 
 @dataclass
 class SheetsDependencies():
     sheets_service: Resource
     spreadsheet_id: str
+    metadata: SheetMetadataCache = field(default_factory=SheetMetadataCache)
+    quota: SheetsQuota = field(default_factory=SheetsQuota)
+    max_workers: int = 4
+    # When set, each worker thread gets its own service from the pool
+    services: Optional[ServicePool] = None
+    # The only directory sync_csv_to_sheet may read from
+    csv_dir: Path = field(default_factory=lambda: Path(os.getenv('SHEETS_CSV_DIR', '.')))
+    writes: BatchUpdateQueue = field(init=False)
+    executor: ThreadPoolExecutor = field(init=False)
+
+    def __post_init__(self):
+        self.writes = BatchUpdateQueue(self.batch_update)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='sheets')
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        Runs a blocking API call in the bounded pool, so tool calls from one
+        model response proceed concurrently without blocking the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def close(self) -> None:
+        """Sends any queued writes and stops the worker threads."""
+        self.writes.close()
+        self.executor.shutdown()
+
+    def csv_file(self, csv_path: str) -> Path:
+        """Resolves a CSV path the model gave, refusing anything outside csv_dir."""
+        root = self.csv_dir.resolve()
+        path = (root / csv_path).resolve()
+        if not path.is_relative_to(root) or path.suffix.lower() != '.csv':
+            raise PermissionError(f'Only .csv files under {root} can be synced, not {csv_path!r}')
+        return path
+
+    def service(self) -> Resource:
+        if self.services is not None:
+            return self.services.get()
+        return self.sheets_service
+
+    def sheets(self) -> list[dict[str, Any]]:
+        return self.metadata.sheets(self.service(), self.spreadsheet_id, self.quota.read)
+
+    def sheet_id(self, sheet_name: str) -> int | None:
+        return self.metadata.sheet_id(self.service(), self.spreadsheet_id, sheet_name, self.quota.read)
+
+    async def mutate(self, request: dict[str, Any]) -> dict[str, Any]:
+        """
+        Queues one mutation behind the other tool calls of this turn and
+        returns its own reply once the combined batchUpdate is back.
+        """
+        return await asyncio.wrap_future(self.writes.submit(request))
+
+    def batch_update(self, requests: list[dict[str, Any]]) -> dict[str, Any]:
+        """
+        Sends `requests` in one batchUpdate and keeps the metadata cache in
+        step with the reply.
+        """
+        try:
+            response = self.quota.write(self.service().spreadsheets().batchUpdate(
+                spreadsheetId=self.spreadsheet_id,
+                body={'requests': requests}
+            ))
+        except Exception:
+            self.metadata.invalidate(self.spreadsheet_id)
+            raise
+        self.metadata.apply_replies(self.spreadsheet_id, requests, response.get('replies', []))
+        return response
 
 class SheetsResult(BaseModel):
     request_status: bool = Field(description='Status pf the request')
@@ -26,23 +105,35 @@ def init_google_sheets_client() -> Resource:
     SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
     service = create_service(client_secret, API_NAME, API_VERSION, SCOPES)
     return service
+
+def init_google_sheets_pool() -> ServicePool:
+    client_secret = 'credentials.json'
+    API_NAME = 'sheets'
+    API_VERSION = 'v4'
+    SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+    return create_service_pool(client_secret, API_NAME, API_VERSION, SCOPES)
    
 
 sheets_agent = Agent(
-    model=GEMINI_MODEL,
+    model=get_model('gemini'),
     deps_type=SheetsDependencies,
     output_type=SheetsResult,
     system_prompt="""
     You are a Google Sheets agent to help me manage my Google Sheets tasks.
 
-    When making API calls, wait 1 second between each request to avoid rate limits.
+    Call independent tools together in one response, their changes are sent to
+    the API as a single batch.
+
+    To load a CSV file into a sheet use `sync_csv_to_sheet`, never write it
+    cell by cell.
     """,
     model_settings=ModelSettings(timeout=10),
     retries=3
 )
 
 @sheets_agent.tool(retries=2)
-def add_sheet(ctx: RunContext[SheetsDependencies], sheet_name: str) -> Any:
+@instrumented_tool
+async def add_sheet(ctx: RunContext[SheetsDependencies], sheet_name: str) -> Any:
     """
     Adds a new sheet to an existing Google Spreadsheet
 
@@ -56,29 +147,25 @@ def add_sheet(ctx: RunContext[SheetsDependencies], sheet_name: str) -> Any:
     """
     try:
         print(f'Calling add_sheet to add sheet "{sheet_name}"')
-        request_body = {
-            'requests': [{
-                'addSheet': {
-                    'properties': {
-                        'title': sheet_name
-                    }
+        request = {
+            'addSheet': {
+                'properties': {
+                    'title': sheet_name
                 }
-            }]
+            }
         }
-        response = ctx.deps.sheets_service.spreadsheets().batchUpdate(
-            spreadsheetId=ctx.deps.spreadsheet_id,
-            body=request_body
-        ).execute()
+        response = await ctx.deps.mutate(request)
 
         return response
+    except ssl.SSLError as e:
+        raise ModelRetry(f'An error occurred: {str(e)}. Please try again')
+
     except (Exception, UnexpectedModelBehavior) as e:
         return f'An error occurred: {str(e)}'
 
-    except ssl.SSL_ERROR_SSL as e:
-        raise ModelRetry(f'An error occurred: {str(e)}. Please try again')
-
 @sheets_agent.tool(retries=2)
-def delete_sheet(ctx: RunContext[SheetsDependencies], sheet_name: str) -> Any:
+@instrumented_tool
+async def delete_sheet(ctx: RunContext[SheetsDependencies], sheet_name: str) -> Any:
     """
     Deletes a sheet from an existing Google Spreadsheet by sheet name
 
@@ -90,72 +177,130 @@ def delete_sheet(ctx: RunContext[SheetsDependencies], sheet_name: str) -> Any:
         Response from the API after deletion
     """
     print(f'Calling delete_sheet to delete sheet "{sheet_name}')
-    sheet_metadata = ctx.deps.sheets_service.spreadsheets().get(
-        spreadsheetId=ctx.deps.spreadsheet_id
-    ).execute()
-
-    sheet_id = None
-    for sheet in sheet_metadata.get('sheets', ''):
-        if sheet['properties']['title'] == sheet_name:
-            sheet_id = sheet['properties']['sheetId']
-            break
-    
-    if not sheet_id:
+    sheet_id = await ctx.deps.run(ctx.deps.sheet_id, sheet_name)
+
+    # The first sheet's id is 0
+    if sheet_id is None:
         print(f"Sheet '{sheet_name}' not found")
         return f"Sheet '{sheet_name}' is already deleted or does not exist"
 
-    request_body = {
-        'requests' : [{
-            'deleteSheet': {
-                'sheetId': sheet_id
-            }
-        }]
+    request = {
+        'deleteSheet': {
+            'sheetId': sheet_id
+        }
     }
     try:
-        response = ctx.deps.sheets_service.spreadsheets().batchUpdate(
-            spreadsheetId=ctx.deps.spreadsheet_id,
-            body=request_body
-        ).execute()
+        response = await ctx.deps.mutate(request)
         return response
+    except ssl.SSLError as e:
+        raise ModelRetry(f'An error occured: {str(e)}. Please try again')
+
     except (Exception, UnexpectedModelBehavior) as e:
         return f'An error occured {str(e)}'
 
-    except ssl.SSL_ERROR_SSL as e:
-        raise ModelRetry(f'An error occured: {str(e)}. Please try again')
-
 @sheets_agent.tool(retries=2)
-def list_sheets(ctx: RunContext[SheetsDependencies]) -> List[Dict[str, Any]]:
+@instrumented_tool
+async def list_sheets(ctx: RunContext[SheetsDependencies]) -> List[Dict[str, Any]]:
     try:
         print('Calling list_sheets')
-        sheet_metadata = ctx.deps.sheets_service.spreadsheets().get(spreadsheetId=ctx.deps.spreadsheet_id).execute()
-        sheets = sheet_metadata.get('sheets', [])
+        sheets = await ctx.deps.run(ctx.deps.sheets)
         if not sheets:
             return 'No sheets found'
-        sheet_list = [{'id': sheet['properties']['sheetId'], 'name': sheet['properties']['title']} for sheet in sheets]
+        sheet_list = [{'id': sheet['sheetId'], 'name': sheet['title']} for sheet in sheets]
         return sheet_list
-    except ssl.SSL_ERROR_SSL as e:
+    except ssl.SSLError as e:
         raise ModelRetry(f'An error occured: {str(e)}. Please try again')
 
-if __name__ == "__main__":
-    SPREADSHEET_ID = '1H81qVQM5qnSLOKiX9cs1BgYL6p4KbRxwwaUZOi-fjB4'
+@sheets_agent.tool(retries=2)
+@instrumented_tool
+async def sync_csv_to_sheet(ctx: RunContext[SheetsDependencies], csv_path: str, sheet_name: str) -> Any:
+    """
+    Loads a CSV file into a sheet, creating the sheet if needed. Running it
+    again only writes the rows that changed since the last sync.
 
-    service = init_google_sheets_client()
+    Args:
+        ctx: Run context containing sheets service and spreadsheet ID
+        csv_path: Path of the CSV file inside the CSV directory, its first row is the header
+        sheet_name: Name of the target sheet
 
-    deps = SheetsDependencies(service, SPREADSHEET_ID)
+    Returns:
+        How many rows were written, appended and cleared
+    """
+    try:
+        print(f'Calling sync_csv_to_sheet to load "{csv_path}" into "{sheet_name}"')
+        path = ctx.deps.csv_file(csv_path)
+        result = await ctx.deps.run(sync_csv, ctx.deps, sheet_name, path)
+        return vars(result)
+    except ssl.SSLError as e:
+        raise ModelRetry(f'An error occured: {str(e)}. Please try again')
 
-    import sys
+    except FileNotFoundError:
+        raise ModelRetry(f'No file at {csv_path!r}')
 
-    prompt = input('User: ')
-    if prompt.lower() == 'exit':
-        sys.exit('See you next time')
+    except PermissionError as e:
+        raise ModelRetry(str(e))
 
-    response = sheets_agent.run_sync(prompt.strip(), deps=deps)
-    print(f'Sheets Agent: {response.output}')
+    except Exception as e:
+        return f'An error occured {str(e)}'
 
+@dataclass
+class SheetsSession:
+    """
+    One conversation with the Sheets agent on a single event loop, so the
+    model's HTTP connections and the Google services stay warm between
+    turns. History is compacted to `max_history_tokens` after every turn.
+    """
+    deps: SheetsDependencies
+    max_history_tokens: int = 8000
+    messages: list[ModelMessage] = field(default_factory=list)
+
+    async def start(self) -> None:
+        """
+        Refreshes credentials, builds a service per worker thread and connects
+        to the model provider at the same time, then loads the sheet metadata.
+        """
+        # Hold every worker until all of them are busy, so each thread builds
+        # its own service instead of one thread building them all
+        barrier = threading.Barrier(self.deps.max_workers)
+
+        def build() -> None:
+            self.deps.service()
+            try:
+                barrier.wait(timeout=5)
+            except threading.BrokenBarrierError:
+                pass
+
+        await asyncio.gather(
+            *(self.deps.run(build) for _ in range(self.deps.max_workers)),
+            warm_up(sheets_agent.model),
+        )
+        await self.deps.run(self.deps.sheets)
+
+    async def ask(self, prompt: str) -> SheetsResult:
+        result = await sheets_agent.run(prompt, deps=self.deps, message_history=self.messages)
+        self.messages = compact_history(result.all_messages(), self.max_history_tokens)
+        return result.output
+
+
+async def chat(deps: SheetsDependencies) -> None:
+    session = SheetsSession(deps)
+    await session.start()
     while True:
-        prompt = input('User: ')
+        # input() would block the loop, and with it the warm connections
+        prompt = (await asyncio.to_thread(input, 'User: ')).strip()
         if prompt.lower() == 'exit':
-            sys.exit('See you next time') 
-        #response = sheets_agetn.run_sync(prompt.strip(), deps=deps, message_history=response.all_messages())
-        response = sheets_agent.run_sync(prompt.strip(), deps=deps)
-        print(f'Sheets Agent: {response.output.result_details}')
\ No newline at end of file
+            print('See you next time')
+            return
+        output = await session.ask(prompt)
+        print(f'Sheets Agent: {output.result_details}')
+
+if __name__ == "__main__":
+    SPREADSHEET_ID = '1H81qVQM5qnSLOKiX9cs1BgYL6p4KbRxwwaUZOi-fjB4'
+
+    pool = init_google_sheets_pool()
+
+    deps = SheetsDependencies(pool.get(), SPREADSHEET_ID, services=pool)
+    try:
+        asyncio.run(chat(deps))
+    finally:
+        deps.close()
@@ -0,0 +1,119 @@
+"""
+Coalescing write queue for Sheets batchUpdate requests.
+
+Tool calls from one model response run concurrently, and each used to send a
+batchUpdate holding a single request. Mutations submitted here are held for
+`window` seconds (or until `max_requests` are waiting) and then sent together
+in one batchUpdate; every caller gets back its own entry from `replies`.
+
+batchUpdate is all or nothing, so when a combined batch is rejected as invalid
+the requests are resent one by one and only the bad one fails.
+"""
+import time
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable
+
+from googleapiclient.errors import HttpError
+
+SendFn = Callable[[list[dict[str, Any]]], dict[str, Any]]
+
+
+class BatchUpdateQueue:
+    def __init__(self, send: SendFn, window: float = 0.05, max_requests: int = 100):
+        self.send = send
+        self.window = window
+        self.max_requests = max_requests
+        self._pending: list[tuple[dict[str, Any], Future]] = []
+        self._deadline: float | None = None
+        self._closed = False
+        self._wakeup = threading.Condition()
+        self._sender: threading.Thread | None = None
+
+    def submit(self, request: dict[str, Any]) -> Future:
+        """
+        Queues one batchUpdate request.
+
+        Returns:
+            A future resolving to this request's reply
+        """
+        future: Future = Future()
+        with self._wakeup:
+            if self._closed:
+                raise RuntimeError('BatchUpdateQueue is closed')
+            self._pending.append((request, future))
+            if self._deadline is None:
+                self._deadline = time.monotonic() + self.window
+            if self._sender is None:
+                # One long-lived sender, so submit never blocks an event loop
+                # and every batch goes out on the same thread's service and
+                # connection instead of a fresh one per flush
+                self._sender = threading.Thread(target=self._run, name='sheets-writes', daemon=True)
+                self._sender.start()
+            self._wakeup.notify()
+        return future
+
+    def flush(self) -> None:
+        """Sends whatever is queued right away."""
+        while True:
+            with self._wakeup:
+                batch = self._take()
+            if not batch:
+                return
+            self._send(batch)
+
+    def close(self) -> None:
+        """Sends what is still queued and stops the sender thread."""
+        with self._wakeup:
+            self._closed = True
+            self._wakeup.notify()
+            sender = self._sender
+        if sender is not None:
+            sender.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._wakeup:
+                while not self._ready():
+                    if self._closed and not self._pending:
+                        return
+                    timeout = self._deadline - time.monotonic() if self._pending else None
+                    self._wakeup.wait(timeout)
+                batch = self._take()
+            self._send(batch)
+
+    def _ready(self) -> bool:
+        if not self._pending:
+            return False
+        return self._closed or len(self._pending) >= self.max_requests or time.monotonic() >= self._deadline
+
+    def _take(self) -> list[tuple[dict[str, Any], Future]]:
+        # Anything past max_requests has waited as long already and goes next
+        batch, self._pending = self._pending[:self.max_requests], self._pending[self.max_requests:]
+        if not self._pending:
+            self._deadline = None
+        return batch
+
+    def _send(self, batch: list[tuple[dict[str, Any], Future]]) -> None:
+        requests = [request for request, _ in batch]
+        try:
+            response = self.send(requests)
+        except HttpError as e:
+            if len(batch) > 1 and e.resp.status == 400:
+                for item in batch:
+                    self._send([item])
+                return
+            self._fail(batch, e)
+            return
+        except Exception as e:  # noqa: BLE001 - handed to the callers
+            self._fail(batch, e)
+            return
+
+        replies = response.get('replies', [])
+        for index, (_, future) in enumerate(batch):
+            future.set_result(replies[index] if index < len(replies) else {})
+
+    @staticmethod
+    def _fail(batch: list[tuple[dict[str, Any], Future]], error: BaseException) -> None:
+        for _, future in batch:
+            future.set_exception(error)
@@ -0,0 +1,136 @@
+"""
+Per-spreadsheet sheet metadata cache for the Sheets agent.
+
+Tools look sheets up by name, which used to mean a full `spreadsheets().get()`
+on every call. The cache fetches only `sheets.properties`, keeps a
+title -> sheetId index, and is patched in place from `batchUpdate` replies
+(addSheet returns the new properties, deleteSheet removes a known id), so a
+chain of tool calls needs one metadata round trip instead of one per call.
+Entries expire after `ttl` seconds and are dropped whenever a call fails,
+since the spreadsheet may then be in a state we didn't see.
+"""
+import time
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from googleapiclient.discovery import Resource
+from googleapiclient.http import HttpRequest
+
+METADATA_FIELDS = 'sheets.properties'
+
+ExecuteFn = Callable[[HttpRequest], dict[str, Any]]
+
+
+def _execute(request: HttpRequest) -> dict[str, Any]:
+    return request.execute()
+
+
+@dataclass
+class SheetIndex:
+    fetched_at: float
+    # sheetId -> properties, in the order the sheets appear in the spreadsheet
+    properties: dict[int, dict[str, Any]] = field(default_factory=dict)
+    ids_by_title: dict[str, int] = field(default_factory=dict)
+
+    def add(self, props: dict[str, Any]) -> None:
+        self.properties[props['sheetId']] = props
+        self.ids_by_title[props['title']] = props['sheetId']
+
+    def remove(self, sheet_id: int) -> None:
+        props = self.properties.pop(sheet_id, None)
+        if props is not None:
+            self.ids_by_title.pop(props['title'], None)
+
+
+class SheetMetadataCache:
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._indexes: dict[str, SheetIndex] = {}
+        self._lock = threading.Lock()
+
+    def _fresh(self, spreadsheet_id: str) -> SheetIndex | None:
+        index = self._indexes.get(spreadsheet_id)
+        if index is None or time.monotonic() - index.fetched_at > self.ttl:
+            return None
+        return index
+
+    def _index(self, service: Resource, spreadsheet_id: str, execute: ExecuteFn) -> SheetIndex:
+        with self._lock:
+            index = self._fresh(spreadsheet_id)
+        if index is not None:
+            return index
+
+        try:
+            metadata = execute(service.spreadsheets().get(
+                spreadsheetId=spreadsheet_id,
+                fields=METADATA_FIELDS,
+            ))
+        except Exception:
+            self.invalidate(spreadsheet_id)
+            raise
+
+        index = SheetIndex(fetched_at=time.monotonic())
+        for sheet in metadata.get('sheets', []):
+            index.add(sheet['properties'])
+        with self._lock:
+            self._indexes[spreadsheet_id] = index
+        return index
+
+    def sheets(
+        self,
+        service: Resource,
+        spreadsheet_id: str,
+        execute: ExecuteFn = _execute,
+    ) -> list[dict[str, Any]]:
+        """Returns the properties of every sheet, in spreadsheet order."""
+        index = self._index(service, spreadsheet_id, execute)
+        with self._lock:
+            return list(index.properties.values())
+
+    def sheet_id(
+        self,
+        service: Resource,
+        spreadsheet_id: str,
+        title: str,
+        execute: ExecuteFn = _execute,
+    ) -> int | None:
+        """Returns the sheetId for `title`, or None if there is no such sheet."""
+        index = self._index(service, spreadsheet_id, execute)
+        with self._lock:
+            return index.ids_by_title.get(title)
+
+    def apply_replies(
+        self,
+        spreadsheet_id: str,
+        requests: list[dict[str, Any]],
+        replies: list[dict[str, Any]],
+    ) -> None:
+        """
+        Patches the cached index with the outcome of a successful batchUpdate.
+        Anything the cache can't account for drops the entry instead.
+        """
+        with self._lock:
+            index = self._indexes.get(spreadsheet_id)
+            if index is None:
+                return
+            for request, reply in zip(requests, replies):
+                if 'addSheet' in request:
+                    props = (reply or {}).get('addSheet', {}).get('properties')
+                    if props is None:
+                        self._indexes.pop(spreadsheet_id, None)
+                        return
+                    index.add(props)
+                elif 'deleteSheet' in request:
+                    index.remove(request['deleteSheet']['sheetId'])
+                else:
+                    # Renames, moves and the like, just refetch next time
+                    self._indexes.pop(spreadsheet_id, None)
+                    return
+
+    def invalidate(self, spreadsheet_id: str | None = None) -> None:
+        with self._lock:
+            if spreadsheet_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(spreadsheet_id, None)
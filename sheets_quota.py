@@ -0,0 +1,61 @@
+"""
+Client-side pacing for Google Sheets API calls.
+
+The Sheets API allows 60 read and 60 write requests per minute per user (300
+per project). Each kind of call waits on its own token bucket before it goes
+out, and 429s or transient 5xx responses are retried here with truncated
+exponential backoff, honouring Retry-After, instead of being bounced back to
+the model.
+"""
+import time
+import random
+from typing import Any
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+from rate_limit import TokenBucket
+
+READS_PER_MINUTE = 60
+WRITES_PER_MINUTE = 60
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class SheetsQuota:
+    def __init__(
+        self,
+        reads_per_minute: float = READS_PER_MINUTE,
+        writes_per_minute: float = WRITES_PER_MINUTE,
+        burst: float = 10,
+        max_retries: int = 5,
+        max_backoff: float = 32.0,
+    ):
+        self.reads = TokenBucket(reads_per_minute / 60, capacity=burst)
+        self.writes = TokenBucket(writes_per_minute / 60, capacity=burst)
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+
+    def read(self, request: HttpRequest) -> dict[str, Any]:
+        return self._execute(request, self.reads)
+
+    def write(self, request: HttpRequest) -> dict[str, Any]:
+        return self._execute(request, self.writes)
+
+    def _execute(self, request: HttpRequest, bucket: TokenBucket) -> dict[str, Any]:
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            try:
+                return request.execute()
+            except HttpError as e:
+                if e.resp.status not in RETRY_STATUSES or attempt == self.max_retries:
+                    raise
+                delay = self._backoff(e, attempt)
+                print(f'Sheets API returned {e.resp.status}, retrying in {delay:.1f}s')
+                time.sleep(delay)
+        raise AssertionError('unreachable')
+
+    def _backoff(self, error: HttpError, attempt: int) -> float:
+        retry_after = error.resp.get('retry-after')
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+        return min(2 ** attempt + random.random(), self.max_backoff)
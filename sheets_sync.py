@@ -0,0 +1,242 @@
+"""
+Bulk CSV / DataFrame sync into a Google Sheet.
+
+The sheet's current values are read once, then the new rows are streamed
+against them: existing rows are rewritten only over the span of cells that
+changed, new rows are appended and rows that are gone are cleared. Writes go
+out in `values.batchUpdate` / `values.append` calls of at most `max_bytes`
+each, so tens of thousands of rows take a handful of API calls.
+
+    deps = SheetsDependencies(service, spreadsheet_id)
+    result = sync_csv(deps, 'Products', 'product_listings_2025-09-09_13-00-23.csv')
+
+Values are written RAW as strings, which is also how they read back, so an
+unchanged file syncs with no writes at all.
+"""
+import csv
+import itertools
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, Sequence
+
+import pandas as pd
+
+if TYPE_CHECKING:
+    from sheets_agent import SheetsDependencies
+
+# Google recommends keeping request bodies under 2 MB. Chunks are sized from
+# an estimate of the JSON, so aim for half that.
+MAX_BYTES = 1_000_000
+
+
+@dataclass
+class SyncResult:
+    rows: int = 0
+    updated_rows: int = 0
+    updated_cells: int = 0
+    appended_rows: int = 0
+    cleared_rows: int = 0
+    api_calls: int = 0
+
+
+def column_letter(index: int) -> str:
+    """0 -> A, 25 -> Z, 26 -> AA"""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def _quote(sheet_name: str) -> str:
+    return "'" + sheet_name.replace("'", "''") + "'"
+
+
+def _range(sheet_name: str, row: int, first_col: int, last_col: int) -> str:
+    # row is 0-based here, A1 notation is 1-based
+    return f'{_quote(sheet_name)}!{column_letter(first_col)}{row + 1}:{column_letter(last_col)}{row + 1}'
+
+
+def _cell(value: Any) -> str:
+    # DataFrames mark blanks with NaN, pd.NA or NaT depending on the dtype
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return ''
+    return str(value)
+
+
+def _trim(row: Sequence[str]) -> list[str]:
+    # The API leaves trailing empty cells out of what it returns
+    row = list(row)
+    while row and row[-1] == '':
+        row.pop()
+    return row
+
+
+def _changed_span(old: list[str], new: list[str]) -> tuple[int, int] | None:
+    width = max(len(old), len(new))
+    old = old + [''] * (width - len(old))
+    new = new + [''] * (width - len(new))
+    changed = [i for i in range(width) if old[i] != new[i]]
+    if not changed:
+        return None
+    return changed[0], changed[-1]
+
+
+def _size(values: list[str]) -> int:
+    # JSON quoting and separators, close enough for chunking
+    return sum(len(v) + 4 for v in values) + 64
+
+
+class _Writer:
+    """Buffers value ranges and appended rows, sending each when it fills up."""
+
+    def __init__(self, deps: 'SheetsDependencies', sheet_name: str, value_input_option: str, max_bytes: int, result: SyncResult):
+        self.deps = deps
+        self.sheet_name = sheet_name
+        self.value_input_option = value_input_option
+        self.max_bytes = max_bytes
+        self.result = result
+        self.updates: list[dict[str, Any]] = []
+        self.update_bytes = 0
+        self.appends: list[list[str]] = []
+        self.append_start = 0
+        self.append_bytes = 0
+
+    def values(self):
+        return self.deps.service().spreadsheets().values()
+
+    def update(self, row: int, first_col: int, last_col: int, values: list[str]) -> None:
+        size = _size(values)
+        if self.updates and self.update_bytes + size > self.max_bytes:
+            self.flush_updates()
+        self.updates.append({'range': _range(self.sheet_name, row, first_col, last_col), 'values': [values]})
+        self.update_bytes += size
+
+    def append(self, row: int, values: list[str]) -> None:
+        size = _size(values)
+        if self.appends and self.append_bytes + size > self.max_bytes:
+            self.flush_appends()
+        if not self.appends:
+            self.append_start = row
+        self.appends.append(values)
+        self.append_bytes += size
+
+    def flush_updates(self) -> None:
+        if not self.updates:
+            return
+        self.deps.quota.write(self.values().batchUpdate(
+            spreadsheetId=self.deps.spreadsheet_id,
+            body={'valueInputOption': self.value_input_option, 'data': self.updates},
+        ))
+        self.result.api_calls += 1
+        self.updates, self.update_bytes = [], 0
+
+    def flush_appends(self) -> None:
+        if not self.appends:
+            return
+        # Starting the append at the first free row keeps it from attaching to
+        # some other table further up the sheet
+        self.deps.quota.write(self.values().append(
+            spreadsheetId=self.deps.spreadsheet_id,
+            range=f'{_quote(self.sheet_name)}!A{self.append_start + 1}',
+            valueInputOption=self.value_input_option,
+            insertDataOption='INSERT_ROWS',
+            body={'values': self.appends},
+        ))
+        self.result.api_calls += 1
+        self.appends, self.append_bytes = [], 0
+
+    def flush(self) -> None:
+        self.flush_updates()
+        self.flush_appends()
+
+
+def sync_rows(
+    deps: 'SheetsDependencies',
+    sheet_name: str,
+    rows: Iterable[Sequence[Any]],
+    max_bytes: int = MAX_BYTES,
+    value_input_option: str = 'RAW',
+) -> SyncResult:
+    """
+    Makes `sheet_name` hold exactly `rows`, starting at A1, creating the sheet
+    if it doesn't exist.
+
+    Args:
+        deps: Sheets service, spreadsheet and quota to use
+        sheet_name: Target sheet
+        rows: Rows to write, header included, consumed lazily
+        max_bytes: Rough upper bound on the body of each write call
+        value_input_option: RAW keeps values as text, USER_ENTERED parses them
+            like typed input, which makes unchanged numbers and dates show up
+            as changes on the next sync
+
+    Returns:
+        What was written and how many API calls it took
+    """
+    result = SyncResult()
+    if deps.sheet_id(sheet_name) is None:
+        deps.batch_update([{'addSheet': {'properties': {'title': sheet_name}}}])
+        result.api_calls += 1
+        existing = []
+    else:
+        response = deps.quota.read(deps.service().spreadsheets().values().get(
+            spreadsheetId=deps.spreadsheet_id,
+            range=_quote(sheet_name),
+        ))
+        result.api_calls += 1
+        existing = [_trim(map(_cell, row)) for row in response.get('values', [])]
+
+    writer = _Writer(deps, sheet_name, value_input_option, max_bytes, result)
+    width = 0
+    for index, row in enumerate(rows):
+        new = _trim(map(_cell, row))
+        width = max(width, len(new))
+        result.rows += 1
+        if index >= len(existing):
+            writer.append(index, new)
+            result.appended_rows += 1
+            continue
+        span = _changed_span(existing[index], new)
+        if span is None:
+            continue
+        first, last = span
+        # Blank cells clear whatever the old row had past the end of the new one
+        values = (new + [''] * (last + 1 - len(new)))[first:last + 1]
+        writer.update(index, first, last, values)
+        result.updated_rows += 1
+        result.updated_cells += last - first + 1
+    writer.flush()
+
+    if len(existing) > result.rows:
+        width = max(width, *(len(row) for row in existing[result.rows:]), 1)
+        deps.quota.write(deps.service().spreadsheets().values().batchClear(
+            spreadsheetId=deps.spreadsheet_id,
+            body={'ranges': [
+                f'{_quote(sheet_name)}!A{result.rows + 1}:{column_letter(width - 1)}{len(existing)}'
+            ]},
+        ))
+        result.api_calls += 1
+        result.cleared_rows = len(existing) - result.rows
+    if result.appended_rows:
+        # INSERT_ROWS grew the grid
+        deps.metadata.invalidate(deps.spreadsheet_id)
+    return result
+
+
+def read_csv(path: str | Path) -> Iterator[list[str]]:
+    with open(path, newline='', encoding='utf-8') as f:
+        yield from csv.reader(f)
+
+
+def sync_csv(deps: 'SheetsDependencies', sheet_name: str, path: str | Path, **kwargs: Any) -> SyncResult:
+    """Syncs a CSV file, header row included, into `sheet_name`."""
+    return sync_rows(deps, sheet_name, read_csv(path), **kwargs)
+
+
+def sync_frame(deps: 'SheetsDependencies', sheet_name: str, frame: Any, index: bool = False, **kwargs: Any) -> SyncResult:
+    """Syncs a pandas DataFrame, with its column names as the header row."""
+    header = [frame.index.name or ''] * index + list(frame.columns)
+    rows = frame.itertuples(index=index, name=None)
+    return sync_rows(deps, sheet_name, itertools.chain([header], rows), **kwargs)
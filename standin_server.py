@@ -0,0 +1,301 @@
+"""
+Local stand-in for an OpenAI-compatible chat completions API.
+
+Answers POST /v1/chat/completions the way a provider would, following a
+script per agent: the tool calls in SCRIPTS, one model turn each, then the
+final output. Structured outputs are generated from the output tool's JSON
+schema, and agents with a plain text output get a short sentence. It also
+serves a synthetic product listing page at GET /listing for the scraper to
+fetch, so nothing leaves the machine.
+
+Latency is drawn from a log-normal distribution around --latency, and
+--error-rate of the requests fail with --error-status, to see how retries and
+tail latency behave under load.
+
+    python standin_server.py --port 8765 --latency 0.3 --error-rate 0.02
+
+Point a model at it with:
+
+    OpenAIChatModel('gpt-5-nano', provider=OpenAIProvider(base_url='http://127.0.0.1:8765/v1', api_key='standin'))
+
+Requests with `"stream": true` get the same completion as server-sent
+`chat.completion.chunk` events, a last chunk carrying the usage, then
+`data: [DONE]`.
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from dataclasses import dataclass
+from typing import Any
+
+CHARS_PER_TOKEN = 4
+ITEMS_PER_ARRAY = 20
+STREAM_PIECE_CHARS = 64
+
+# Tool calls per model turn, keyed by a tool that identifies the agent. After
+# the script runs out the agent gets its final output.
+SCRIPTS: dict[str, list[list[tuple[str, dict[str, Any]]]]] = {
+    'get_lat_lang_many': [
+        [('get_lat_lang_many', {'location_descriptions': ['London', 'San Francisco, CA']})],
+        [('get_weather_many', {'locations': [
+            {'lat': 10.795323, 'lng': -55.393958},
+            {'lat': 37.7749, 'lng': -122.4194},
+        ]})],
+    ],
+    'fetch_html_text': [
+        [('fetch_html_text', {'url': '{base_url}/listing?q=laptop'})],
+    ],
+}
+# When an agent has several output tools (a union output type), the first of
+# these that it offers is used
+OUTPUT_PREFERENCE = ('EmailOk',)
+TEXT_OUTPUT = 'It is snowing in London and windy in San Francisco.'
+
+
+@dataclass
+class Behaviour:
+    latency: float = 0.2
+    latency_sigma: float = 0.5
+    error_rate: float = 0.0
+    error_status: int = 503
+
+    def delay(self) -> float:
+        if self.latency <= 0:
+            return 0.0
+        # Median `latency`, with a long right tail like real providers
+        return self.latency * random.lognormvariate(0, self.latency_sigma)
+
+
+def fake_value(schema: dict[str, Any], defs: dict[str, Any], index: int = 0, name: str = 'value') -> Any:
+    """A deterministic value that validates against a JSON schema."""
+    if '$ref' in schema:
+        return fake_value(defs[schema['$ref'].split('/')[-1]], defs, index, name)
+    for key in ('anyOf', 'oneOf'):
+        if key in schema:
+            options = [s for s in schema[key] if s.get('type') != 'null'] or schema[key]
+            return fake_value(options[0], defs, index, name)
+    if 'enum' in schema:
+        return schema['enum'][0]
+    if 'const' in schema:
+        return schema['const']
+    kind = schema.get('type', 'object')
+    if kind == 'object':
+        properties = schema.get('properties', {})
+        return {key: fake_value(value, defs, index, key) for key, value in properties.items()}
+    if kind == 'array':
+        count = max(schema.get('minItems', 0), min(schema.get('maxItems', ITEMS_PER_ARRAY), ITEMS_PER_ARRAY))
+        return [fake_value(schema.get('items', {}), defs, i, name) for i in range(count)]
+    if kind == 'integer':
+        return 100 + index
+    if kind == 'number':
+        return 1000.0 + index
+    if kind == 'boolean':
+        return True
+    if schema.get('format') == 'email':
+        return f'user{index}@example.com'
+    return f'{name.replace("_", " ")} {index}'
+
+
+def _turn(messages: list[dict[str, Any]]) -> int:
+    # Assistant turns since the last user message, earlier runs in the
+    # history don't count
+    turn = 0
+    for message in messages:
+        if message.get('role') == 'user':
+            turn = 0
+        elif message.get('role') == 'assistant':
+            turn += 1
+    return turn
+
+
+def _tool_call(name: str, arguments: dict[str, Any]) -> dict[str, Any]:
+    return {
+        'id': f'call_{random.getrandbits(48):012x}',
+        'type': 'function',
+        'function': {'name': name, 'arguments': json.dumps(arguments)},
+    }
+
+
+def respond(body: dict[str, Any], base_url: str) -> dict[str, Any]:
+    """Builds the next completion for a chat completions request body."""
+    messages = body.get('messages', [])
+    tools = {t['function']['name']: t['function'] for t in body.get('tools', [])}
+    output_tools = [name for name in tools if name.startswith('final_result')]
+    script = next((steps for key, steps in SCRIPTS.items() if key in tools), [])
+    turn = _turn(messages)
+
+    message: dict[str, Any] = {'role': 'assistant', 'content': None}
+    if turn < len(script):
+        message['tool_calls'] = [
+            _tool_call(name, json.loads(json.dumps(args).replace('{base_url}', base_url)))
+            for name, args in script[turn]
+        ]
+    elif output_tools:
+        preferred = [n for n in output_tools if n.endswith(OUTPUT_PREFERENCE)]
+        name = (preferred or output_tools)[0]
+        schema = tools[name].get('parameters', {})
+        message['tool_calls'] = [_tool_call(name, fake_value(schema, schema.get('$defs', {})))]
+    else:
+        message['content'] = TEXT_OUTPUT
+
+    prompt_tokens = len(json.dumps(messages)) // CHARS_PER_TOKEN + 1
+    completion_tokens = len(json.dumps(message)) // CHARS_PER_TOKEN + 1
+    return {
+        'id': f'chatcmpl-{random.getrandbits(64):016x}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'standin'),
+        'choices': [{
+            'index': 0,
+            'message': message,
+            'finish_reason': 'tool_calls' if 'tool_calls' in message else 'stop',
+        }],
+        'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def stream_chunks(completion: dict[str, Any]) -> list[dict[str, Any]]:
+    """Splits a completion into the chunks a streaming provider would send."""
+    base = {key: completion[key] for key in ('id', 'created', 'model')}
+    choice = completion['choices'][0]
+    message = choice['message']
+
+    def chunk(delta: dict[str, Any], finish_reason: str | None = None) -> dict[str, Any]:
+        return {
+            **base,
+            'object': 'chat.completion.chunk',
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+        }
+
+    chunks = [chunk({'role': 'assistant', 'content': ''})]
+    if message.get('content'):
+        # A word at a time, so callers see several text deltas
+        words = message['content'].split(' ')
+        chunks += [chunk({'content': word if i == 0 else f' {word}'}) for i, word in enumerate(words)]
+    for index, call in enumerate(message.get('tool_calls', [])):
+        # Arguments arrive in pieces, like a model writing them out
+        arguments = call['function']['arguments']
+        head = {**call, 'function': {'name': call['function']['name'], 'arguments': ''}}
+        chunks.append(chunk({'tool_calls': [{'index': index, **head}]}))
+        chunks += [
+            chunk({'tool_calls': [{'index': index, 'function': {'arguments': arguments[i:i + STREAM_PIECE_CHARS]}}]})
+            for i in range(0, len(arguments), STREAM_PIECE_CHARS)
+        ]
+    chunks.append(chunk({}, choice['finish_reason']))
+    chunks.append({**base, 'object': 'chat.completion.chunk', 'choices': [], 'usage': completion['usage']})
+    return chunks
+
+
+def listing_page(count: int = 40) -> bytes:
+    """A listing page with repeated product cards, like the sites the scraper targets."""
+    cards = ''.join(
+        f'<div class="card"><a class="title">Brand{i % 5} Laptop {i} 16GB RAM 1TB SSD</a>'
+        f'<span class="price">AED {3000 + i * 17:,}</span><span class="rating">({10 + i})</span></div>'
+        for i in range(count)
+    )
+    return f'<html><body><nav>Home | Laptops</nav><main>{cards}</main></body></html>'.encode()
+
+
+class StandInServer:
+    def __init__(self, behaviour: Behaviour):
+        self.behaviour = behaviour
+        self._page = listing_page()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            # HTTP/1.1 keep-alive, one request after another on the connection
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                status, content_type, payload = await self.route(method, path, body, headers)
+                reason = "OK" if status == 200 else "Error"
+                if isinstance(payload, bytes):
+                    writer.write(
+                        f'HTTP/1.1 {status} {reason}\r\n'
+                        f'Content-Type: {content_type}\r\n'
+                        f'Content-Length: {len(payload)}\r\n'
+                        '\r\n'.encode('latin-1') + payload
+                    )
+                    await writer.drain()
+                else:
+                    # Server-sent events, one HTTP chunk per event
+                    writer.write(
+                        f'HTTP/1.1 {status} {reason}\r\n'
+                        f'Content-Type: {content_type}\r\n'
+                        'Transfer-Encoding: chunked\r\n'
+                        '\r\n'.encode('latin-1')
+                    )
+                    for event in payload:
+                        writer.write(f'{len(event):x}\r\n'.encode('latin-1') + event + b'\r\n')
+                        await writer.drain()
+                    writer.write(b'0\r\n\r\n')
+                    await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(
+        self, method: str, path: str, body: bytes, headers: dict[str, str]
+    ) -> tuple[int, str, bytes | list[bytes]]:
+        if method == 'GET' and path.startswith('/listing'):
+            return 200, 'text/html; charset=utf-8', self._page
+        if method != 'POST' or not path.rstrip('/').endswith('/chat/completions'):
+            return 404, 'application/json', json.dumps({'error': {'message': f'No route {method} {path}'}}).encode()
+
+        request = json.loads(body)
+        await asyncio.sleep(self.behaviour.delay())
+        if random.random() < self.behaviour.error_rate:
+            error = {'error': {'message': 'Injected failure', 'type': 'server_error'}}
+            return self.behaviour.error_status, 'application/json', json.dumps(error).encode()
+        base_url = f"http://{headers.get('host', '127.0.0.1')}"
+        completion = respond(request, base_url)
+        if request.get('stream'):
+            events = [f'data: {json.dumps(c)}\n\n'.encode() for c in stream_chunks(completion)]
+            return 200, 'text/event-stream', events + [b'data: [DONE]\n\n']
+        return 200, 'application/json', json.dumps(completion).encode()
+
+
+async def serve(host: str, port: int, behaviour: Behaviour) -> None:
+    server = await asyncio.start_server(StandInServer(behaviour).handle, host, port, backlog=1024)
+    print(f'Stand-in server listening on http://{host}:{port}/v1', flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='Serve a scripted OpenAI-compatible chat completions API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.2, help='median seconds per completion')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='log-normal spread, 0 for fixed latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of completions that fail')
+    parser.add_argument('--error-status', type=int, default=503)
+    args = parser.parse_args(argv)
+
+    behaviour = Behaviour(args.latency, args.latency_sigma, args.error_rate, args.error_status)
+    try:
+        asyncio.run(serve(args.host, args.port, behaviour))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,38 +1,53 @@
-from typing import Any 
+from typing import Any
 from pydantic import BaseModel, Field
 from pydantic_ai import Agent, ModelRetry, RunContext
-from load_models import GEMINI_MODEL
+from load_models import get_model
+from instrumentation import instrumented_tool
+from ttl_cache import TTLCache
+
+# Geocodes practically never change, weather is stable for a few minutes
+geocode_cache = TTLCache(maxsize=4096, ttl=30 * 24 * 3600)
+weather_cache = TTLCache(maxsize=1024, ttl=10 * 60)
+# Weather is cached per grid cell of this many degrees (0.01 is about 1 km)
+WEATHER_GRID = 0.01
 
 class Deps(BaseModel):
     """ Default Dependencies """
     weather_api_key: str | None = Field(title='Weather API key', description='weather api key')
     geo_api_key: str | None = Field(title='Geo API key', description='geo service api key')
 
+class Coordinates(BaseModel):
+    lat: float = Field(description='The latitude of the location')
+    lng: float = Field(description='The longitude of the location')
+
 weather_agent = Agent(
     name='Weather Agent',
-    model=GEMINI_MODEL,
+    model=get_model('gemini'),
     system_prompt=(
         'Be concise reply one sentence'
         'Use the `get_lat_lang` tool to get the latitude and longitude of the locations, '
-        'then use the `get_weather` tool to get the weather.'
+        'then use the `get_weather` tool to get the weather. '
+        'For more than one location use `get_lat_lang_many` and then `get_weather_many` '
+        'with all of them at once.'
     ),
     deps_type=Deps,
     #result_type=<response object>,
 )
 
 
-@weather_agent.tool
-def get_lat_lang(ctx: RunContext[Deps], location_description:str
-) -> dict[str,float]:
-    """Get the latitude and longitude of the location. 
-    Args:
-        ctx: The context.
-        location_description: A description of a location.
-    """
+class LocationNotFound(Exception):
+    pass
+
+def _location_key(location_description: str) -> str:
+    return ' '.join(location_description.lower().split())
 
+def _weather_key(lat: float, lng: float) -> tuple[float, float]:
+    return round(lat / WEATHER_GRID) * WEATHER_GRID, round(lng / WEATHER_GRID) * WEATHER_GRID
+
+def lookup_lat_lang(location_description: str, api_key: str | None) -> dict[str, float]:
     params = {
         'q': location_description,
-        'api_key': ctx.deps.geo_api_key,
+        'api_key': api_key,
     }
 
     print('params passed by the agent:', params)
@@ -43,9 +58,69 @@ def get_lat_lang(ctx: RunContext[Deps], location_description:str
     elif 'San Francisco' in location_description:
         return {'lat': 37.7749, 'lng': -122.4194}
     else:
-        raise ModelRetry('Could not find the location')
+        raise LocationNotFound('Could not find the location')
+
+def lookup_weather(lat: float, lng: float, api_key: str | None) -> dict[str, Any]:
+    params = {
+        'lat': lat,
+        'lng': lng,
+        'api_key': api_key,
+    }
+    print(f"lat: {lat}, and lng: {lng}")
+    #Simulate an api cll to get the weather info
+    if lat == 10.795323 and lng == -55.393958:
+        return {'temp': 70, 'description': 'Snowing'}
+    elif lat == 37.7749 and lng == -122.4194:
+        return {'temp': 100, 'description': 'Windy'}
+
+def cached_lat_lang(location_description: str, api_key: str | None) -> dict[str, float]:
+    return geocode_cache.get_or_set(
+        _location_key(location_description),
+        lambda: lookup_lat_lang(location_description, api_key),
+    )
+
+def cached_weather(lat: float, lng: float, api_key: str | None) -> dict[str, Any]:
+    return weather_cache.get_or_set(
+        _weather_key(lat, lng),
+        lambda: lookup_weather(lat, lng, api_key),
+    )
+
+
+@weather_agent.tool
+@instrumented_tool
+def get_lat_lang(ctx: RunContext[Deps], location_description:str
+) -> dict[str,float]:
+    """Get the latitude and longitude of the location.
+    Args:
+        ctx: The context.
+        location_description: A description of a location.
+    """
+    try:
+        return cached_lat_lang(location_description, ctx.deps.geo_api_key)
+    except LocationNotFound as e:
+        raise ModelRetry(str(e))
 
 @weather_agent.tool
+@instrumented_tool
+def get_lat_lang_many(ctx: RunContext[Deps], location_descriptions: list[str]) -> dict[str, Any]:
+    """Get the latitude and longitude of several locations in one call.
+    Args:
+        ctx: The context.
+        location_descriptions: Descriptions of the locations.
+
+    Returns:
+        The coordinates for each location, or an error message for locations that were not found
+    """
+    results = {}
+    for location_description in location_descriptions:
+        try:
+            results[location_description] = cached_lat_lang(location_description, ctx.deps.geo_api_key)
+        except LocationNotFound as e:
+            results[location_description] = str(e)
+    return results
+
+@weather_agent.tool
+@instrumented_tool
 def get_weather(ctx: RunContext[Deps], lat: float, lng:float) -> dict[str, Any]:
     """
     Get the weather at a location.
@@ -58,17 +133,28 @@ def get_weather(ctx: RunContext[Deps], lat: float, lng:float) -> dict[str, Any]:
     if lat == 0 and lng == 0:
         raise ModelRetry('Could not find the location')
 
-    params = {
-        'lat': lat,
-        'lng': lng,
-        'api_key': ctx.deps.weather_api_key,
-    }
-    print(f"lat: {lat}, and lng: {lng}")
-    #Simulate an api cll to get the weather info
-    if lat == 10.795323 and lng == -55.393958:
-        return {'temp': 70, 'description': 'Snowing'}
-    elif lat == 37.7749 and lng == -122.4194:
-        return {'temp': 100, 'description': 'Windy'}
+    return cached_weather(lat, lng, ctx.deps.weather_api_key)
+
+@weather_agent.tool
+@instrumented_tool
+def get_weather_many(ctx: RunContext[Deps], locations: list[Coordinates]) -> list[dict[str, Any] | str]:
+    """
+    Get the weather at several locations in one call.
+
+    Args:
+        ctx: The context
+        locations: The coordinates of each location
+
+    Returns:
+        The weather for each location, in the same order
+    """
+    results = []
+    for location in locations:
+        if location.lat == 0 and location.lng == 0:
+            results.append('Could not find the location')
+        else:
+            results.append(cached_weather(location.lat, location.lng, ctx.deps.weather_api_key))
+    return results
 
 
 if __name__ == "__main__":
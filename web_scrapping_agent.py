@@ -1,14 +1,26 @@
+import sys
+import asyncio
+import argparse
 import datetime
-import pandas as pd
 from httpx import Client
-from bs4 import BeautifulSoup
 from pydantic import BaseModel, Field
 from pydantic_ai import Agent
 from pydantic_ai.settings import ModelSettings
+from pydantic_ai.usage import RunUsage
 from pydantic_ai.exceptions import UnexpectedModelBehavior
-from load_models import OPENAI_MODEL # GEMINI_MODEL
+from load_models import get_model
+from instrumentation import instrumented_tool
+from fetch_cache import CachedResponse, FetchCache, CacheMiss
+from html_parse import parse_pool
+from product_cards import Candidate, parse_rating_count
+from row_writer import RowWriter, open_writer
 import os 
 
+CHARS_PER_TOKEN = 4
+
+class FetchError(Exception):
+    pass
+
 class Product(BaseModel):
     bramd_name: str = Field(title='Brand Name', description='The brand name of the product')
     product_name: str = Field(title='Product Name', description='The name of the product')
@@ -18,14 +30,20 @@ class Product(BaseModel):
 class Results(BaseModel):
     dataset: list[Product] = Field(title='Dataset', description='The list of products')
 
+# Column types of written products, for the Parquet schema
+PRODUCT_DTYPES = {'bramd_name': 'string', 'product_name': 'string', 'price': 'string', 'rating_count': 'Int64'}
+
 web_scraping_agent = Agent(
     name='Web Scraping Agent',
-    model=OPENAI_MODEL,
+    model=get_model('openai'), # get_model('gemini')
     system_prompt=("""
     Your task is to convert list of string to dictionaries.
 
     Step 1. Fetch the HTML text from the given URL using the fetch_html_text() function
     Step 2. Takes the output from the Step 1 and clean it up for the final output
+
+    When Step 1 returns lines of 'title | price | rating', each line is one product
+    and '-' marks a missing value.
     """),
 
     retries=2,
@@ -36,49 +54,195 @@ web_scraping_agent = Agent(
     ),
 )
 
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept-Language': 'en-US, en;q=0.5',
+}
+
+# FETCH_CACHE_MODE=offline replays previously fetched pages without the network,
+# FETCH_CACHE_MODE=refresh revalidates every page even when it is still fresh
+fetch_cache = FetchCache(
+    directory=os.getenv('FETCH_CACHE_DIR', '.fetch_cache'),
+    ttl=float(os.getenv('FETCH_CACHE_TTL', '3600')),
+    mode=os.getenv('FETCH_CACHE_MODE', 'default'),
+)
+_client: Client | None = None
+
+def _get_client() -> Client:
+    global _client
+    if _client is None:
+        _client = Client(headers=HEADERS, follow_redirects=True)
+    return _client
+
+def fetch_page(url: str) -> CachedResponse:
+    """
+    Fetches a page through the on-disk fetch cache, keeping the raw bytes.
+    """
+    try:
+        response = fetch_cache.fetch(_get_client(), url, timeout=20)
+    except CacheMiss as e:
+        raise FetchError(str(e)) from e
+    if response.from_cache:
+        print("Serving cached page for URL:", url)
+    else:
+        print("Called URL:", url)
+    if response.status_code != 200:
+        raise FetchError(f"Failed to fetch the HTML text from {url}. Status code: {response.status_code}")
+    return response
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def chunk_blocks(blocks: list[str], max_tokens: int) -> list[str]:
+    """
+    Greedily packs whole blocks into chunks of at most `max_tokens`.
+    A single block larger than the budget becomes a chunk of its own.
+    """
+    chunks, current, current_tokens = [], [], 0
+    for block in blocks:
+        tokens = estimate_tokens(block)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append('\n'.join(current))
+            current, current_tokens = [], 0
+        current.append(block)
+        current_tokens += tokens
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
+
+def _dedupe_key(product: Product) -> tuple:
+    def norm(value: str | None) -> str:
+        return ' '.join((value or '').lower().split())
+    return norm(product.bramd_name), norm(product.product_name), norm(product.price)
+
+def merge_results(parts: list[Results]) -> Results:
+    """
+    Merges per-chunk results in order, dropping duplicate products and
+    keeping the first non-empty rating count seen for each.
+    """
+    merged: dict[tuple, Product] = {}
+    for part in parts:
+        for product in part.dataset:
+            key = _dedupe_key(product)
+            if key not in merged:
+                merged[key] = product
+            elif merged[key].rating_count is None and product.rating_count is not None:
+                merged[key] = merged[key].model_copy(update={'rating_count': product.rating_count})
+    return Results(dataset=list(merged.values()))
+
+async def extract_blocks(
+    blocks: list[str],
+    max_chunk_tokens: int = 2000,
+    concurrency: int = 4,
+) -> tuple[Results, RunUsage]:
+    """
+    Extracts products from a page's blocks by running one agent call per chunk.
+
+    Args:
+        blocks: The page split between products, from the parse pool
+        max_chunk_tokens: Approximate input token budget per chunk
+        concurrency: Maximum number of chunk extractions in flight
+
+    Returns:
+        The merged, deduplicated results and the combined usage of all chunks
+    """
+    chunks = chunk_blocks(blocks, max_chunk_tokens)
+    print(f'Extracting {len(chunks)} chunks, {concurrency} at a time')
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_chunk(chunk: str):
+        async with semaphore:
+            return await chunk_extraction_agent.run(chunk)
+
+    outcomes = await asyncio.gather(*(run_chunk(c) for c in chunks), return_exceptions=True)
+
+    parts, usage = [], RunUsage()
+    for index, outcome in enumerate(outcomes):
+        if isinstance(outcome, BaseException):
+            print(f'Chunk {index} failed: {outcome}')
+            continue
+        parts.append(outcome.output)
+        usage = usage + outcome.usage()
+    return merge_results(parts), usage
+
+def candidates_to_results(candidates: list[Candidate]) -> Results | None:
+    if not candidates:
+        return None
+    return Results(dataset=[
+        Product(
+            bramd_name=c.brand or c.title.split()[0],
+            product_name=c.title,
+            price=c.price,
+            rating_count=parse_rating_count(c.rating),
+        )
+        for c in candidates
+    ])
+
+async def stream_products(prompt: str, writer: RowWriter) -> RunUsage:
+    """
+    Runs the scraping agent with streamed output and writes each product as
+    soon as the model has finished it, instead of after the whole dataset.
+
+    Args:
+        prompt: The URL to scrape
+        writer: Where finished products are appended
+
+    Returns:
+        The usage of the run
+    """
+    written, seen = 0, set()
+
+    def emit(item: Product) -> None:
+        key = _dedupe_key(item)
+        if key not in seen:
+            seen.add(key)
+            writer.write(item)
+
+    async with web_scraping_agent.run_stream(prompt) as result:
+        async for partial in result.stream_output(debounce_by=None):
+            # The last item may still be growing, everything before it is final
+            for item in partial.dataset[written:-1]:
+                emit(Product.model_validate(item.model_dump()))
+                written += 1
+        final = await result.get_output()
+        for item in final.dataset[written:]:
+            emit(item)
+        return result.usage()
+
+chunk_extraction_agent = Agent(
+    name='Chunk Extraction Agent',
+    model=get_model('openai'),
+    system_prompt=("""
+    Convert the product listings below into the dataset. The text is one part
+    of a longer page; only include products that appear in it, and skip
+    any product whose name is cut off.
+    """),
+    retries=2,
+    output_type=Results,
+    model_settings= ModelSettings(
+        max_tokens=4000,
+        temperature=0.1
+    ),
+)
+
 @web_scraping_agent.tool_plain(retries=1)
+@instrumented_tool
 def fetch_html_text(url: str) -> str:
     """
     Fetches the HTML text from a given URL.
-    For debugging, it can also read from 'soup.txt' if the file exists.
+    Product pages are returned as one 'title | price | rating' line per product.
     """
-    static_file_path = 'soup.txt'
-    html_content = ""
-
-    # Option 1: Read from static file if it exists (for debugging)
-    if os.path.exists(static_file_path):
-        print(f"Reading HTML from local file: {static_file_path}")
-        try:
-            with open(static_file_path, 'r', encoding='utf-8') as f:
-                html_content = f.read()
-            print(f'Successfully loaded HTML from {static_file_path}')
-        except Exception as e:
-            print(f"Error reading {static_file_path}: {e}")
-            # Fallback to web fetch if reading fails
-            html_content = ""
-
-    # Option 2: Fetch from URL if static file doesn't exist or reading failed
-    if not html_content:
-        print("Calling URL:", url)
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept-Language': 'en-US, en;q=0.5',
-        }
-        with Client(headers=headers) as client:
-            response = client.get(url, timeout=20)
-            if response.status_code != 200:
-                return f"Failed to fetch the HTML text from {url}. Status code: {response.status_code}"
-            html_content = response.text
-
-            # Always save the fetched HTML to soup.txt for future debugging
-            with open(static_file_path, 'w', encoding='utf-8') as f:
-                f.write(html_content)
-            print(f'Fetched HTML saved to {static_file_path}')
-
-    if html_content:
-        soup = BeautifulSoup(html_content, 'html.parser')
-        # This line will now correctly process either the fetched HTML or the loaded static file HTML
-        return soup.get_text().replace('\n','').replace('\r','')
+    try:
+        response = fetch_page(url)
+    except FetchError as e:
+        return str(e)
+
+    if response.content:
+        # Tools run on worker threads, waiting here doesn't block the loop
+        parsed = parse_pool.submit(response.content, response.encoding).result()
+        if parsed.cards:
+            print(f'Pre-extracted {parsed.cards} product cards')
+        return parsed.text
     else:
         return "No HTML content to process."
 
@@ -119,30 +283,73 @@ def validate_result(result: Results) -> Results:
     print("Validation failed")
     return None
 
-def main() -> None:
-    prompt = 'https://www.flipkart.com/search?q=laptop&otracker=search&otracker1=search&marketplace=FLIPKART&as-show=on&as=off&p%5B%5D=facets.price_range.from%3D75000&p%5B%5D=facets.price_range.to%3DMax&sort=price_desc'
-    # prompt = 'https://www.noon.com/uae-en/search/?q=macbook&originalQuery=macbook&sort[by]=price&sort[dir]=desc&limit=50&page=1&isCarouselView=false'
+DEFAULT_URL = 'https://www.flipkart.com/search?q=laptop&otracker=search&otracker1=search&marketplace=FLIPKART&as-show=on&as=off&p%5B%5D=facets.price_range.from%3D75000&p%5B%5D=facets.price_range.to%3DMax&sort=price_desc'
+# DEFAULT_URL = 'https://www.noon.com/uae-en/search/?q=macbook&originalQuery=macbook&sort[by]=price&sort[dir]=desc&limit=50&page=1&isCarouselView=false'
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='Scrape a product listing page into a CSV.')
+    parser.add_argument('url', nargs='?', default=DEFAULT_URL)
+    parser.add_argument('--chunked', action='store_true', help='extract the page in parallel chunks')
+    parser.add_argument('--max-chunk-tokens', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--stream', action='store_true', help='write products as the model produces them')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    parser.add_argument('--parquet', action='store_true', help='also write a Parquet file when the run finishes')
+    parser.add_argument('--store', help='also add the products to this listings store and show what changed')
+    args = parser.parse_args(argv)
+
+    started = datetime.datetime.now()
+    timestamp = started.strftime('%Y-%m-%d_%H-%M-%S')
+    output_path = f"product_listings_{timestamp}.{args.format}"
+    parquet_path = f"product_listings_{timestamp}.parquet" if args.parquet else None
+
+    prompt = args.url
     try:
-        response = web_scraping_agent.run_sync(prompt)
-        if response is None:
-            # raise UnexpectedModelBehavior('No data returned from the model')
-            return None
-
-        print('-' * 50)
-        print('Input_tokens:', response.usage().request_tokens)
-        print('Output_tokens:', response.usage().response_tokens)
-        print('Total_tokens:', response.usage().total_tokens)
-        print(response)
-        lst = []
-        for item in response.output.dataset:
-            lst.append(item.model_dump())
-
-        timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-        df = pd.DataFrame(lst)
-        df.to_csv(f"product_listings_{timestamp}.csv", index=False)
-    except UnexpectedModelBehavior as e:
+        response = fetch_page(prompt)
+        parsed = parse_pool.submit(response.content, response.encoding, prompt).result()
+        with open_writer(output_path, parquet_path, PRODUCT_DTYPES) as writer:
+            results = candidates_to_results(parsed.known)
+            if results is not None:
+                print(f'Extracted {len(results.dataset)} products without the model')
+            elif args.chunked:
+                results, usage = asyncio.run(
+                    extract_blocks(parsed.blocks, args.max_chunk_tokens, args.concurrency)
+                )
+                print('-' * 50)
+                print('Input_tokens:', usage.input_tokens)
+                print('Output_tokens:', usage.output_tokens)
+                print('Total_tokens:', usage.total_tokens)
+            elif args.stream:
+                usage = asyncio.run(stream_products(prompt, writer))
+                print('-' * 50)
+                print('Input_tokens:', usage.input_tokens)
+                print('Output_tokens:', usage.output_tokens)
+                print('Total_tokens:', usage.total_tokens)
+                results = Results(dataset=[])
+            else:
+                response = web_scraping_agent.run_sync(prompt)
+                if response is None:
+                    # raise UnexpectedModelBehavior('No data returned from the model')
+                    return None
+
+                print('-' * 50)
+                print('Input_tokens:', response.usage().request_tokens)
+                print('Output_tokens:', response.usage().response_tokens)
+                print('Total_tokens:', response.usage().total_tokens)
+                print(response)
+                results = response.output
+
+            for item in results.dataset:
+                writer.write(item)
+        print(f'Wrote {writer.rows} products to {output_path}')
+        if args.store and writer.rows:
+            from listings_store import ListingsStore, read_listings
+            changes = ListingsStore(args.store).add(read_listings(output_path), started)
+            print(f'Stored snapshot {started:%Y-%m-%d %H:%M:%S} in {args.store}')
+            print(changes['status'].value_counts().to_string() if len(changes) else 'No changes since the last snapshot')
+    except (UnexpectedModelBehavior, FetchError) as e:
         print(e)
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
             
\ No newline at end of file